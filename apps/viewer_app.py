@@ -3,20 +3,26 @@ import os
 import json
 import base64
 from io import BytesIO
+from functools import lru_cache
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import geopandas as gpd
+import pyogrio
+from pyogrio.errors import DataSourceError
+import shapely
 from pyproj import Transformer
 from PIL import Image
 
 import streamlit as st
 import folium
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster
+from streamlit.components.v1 import html as st_html
 from streamlit_folium import st_folium
 
-# Mesh snapshot (CPU-only, no OpenGL)
+# Mesh snapshot: pyrender (offscreen GL) is imported lazily; matplotlib is the no-GL fallback
 import trimesh
 import matplotlib
 matplotlib.use("Agg")
@@ -30,6 +36,22 @@ MESH_ROOT = DATA_ROOT / "mesh"
 MAP_ROOT = DATA_ROOT / "mapillary"
 AERIAL_ROOT = DATA_ROOT / "aerial"
 
+# Pre-simplified footprints next to the GPKG (scripts/build_buildings_geojson.py)
+BUILDINGS_GEOJSON = "buildings_4326.geojson"
+BUILDINGS_GEOJSON_META = "buildings_4326.meta.json"  # layer name sidecar (build_buildings_geojson)
+
+# Mapillary metadata columns the map and selection panel actually use
+POINT_COLUMNS = [
+    "id", "lon", "lat", "x_28992", "y_28992", "captured_at_utc", "image_quality",
+    "camera_type", "sequence_id", "compass_angle", "altitude",
+]
+
+# ~0.5 m at Amsterdam's latitude: sub-pixel at the viewer's zoom, drops most footprint vertices
+DISPLAY_SIMPLIFY_DEG = 5e-6
+
+# Face budget for the matplotlib mesh fallback (Poly3DCollection is sorted and drawn in Python)
+MPL_MAX_FACES = 20000
+
 PDOK_AERIAL_URL = (
     "https://service.pdok.nl/hwh/luchtfotorgb/wmts/v1_0"
     "?service=WMTS&request=GetTile&version=1.0.0"
@@ -37,49 +59,82 @@ PDOK_AERIAL_URL = (
     "&TileMatrixSet=EPSG:3857&TileMatrix={z}&TileCol={x}&TileRow={y}"
 )
 
+# Builds one Leaflet marker per [lat, lon, popup_html, id] row in the browser
+MARKER_CALLBACK_JS = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'camera', prefix: 'fa', markerColor: 'red'});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup(row[2], {maxWidth: 340});
+    marker.bindTooltip(String(row[3]));
+    return marker;
+}
+"""
+
 st.set_page_config(page_title="CrossView Viewer", layout="wide")
 st.title("CrossView Viewer — Amsterdam")
 
 
 # ----------------------------- Small helpers -----------------------------
+@lru_cache(maxsize=8)
+def _transformer(src, dst) -> Transformer:
+    """PROJ pipeline setup is paid once per process, not on every rerun."""
+    return Transformer.from_crs(src, dst, always_xy=True)
+
+
 def list_tiles():
     if not PROCESSED_ROOT.exists():
         return []
     return sorted([p.name for p in PROCESSED_ROOT.iterdir() if p.is_dir()])
 
 
+def tile_cache_tag(tile_id: str) -> tuple:
+    """mtimes of the tile's inputs; passed to cached loaders so edits on disk invalidate them."""
+    paths = (
+        PROCESSED_ROOT / tile_id / "manifest.json",
+        MESH_ROOT / tile_id / f"{tile_id}.gpkg",
+        MESH_ROOT / tile_id / BUILDINGS_GEOJSON,
+        MAP_ROOT / tile_id / "meta_clean.parquet",
+        MAP_ROOT / tile_id / "meta_28992.parquet",
+    )
+    return tuple(p.stat().st_mtime if p.exists() else None for p in paths)
+
+
 def load_manifest(tile_id: str) -> dict:
     m = PROCESSED_ROOT / tile_id / "manifest.json"
     return json.loads(m.read_text()) if m.exists() else {}
 
 
-def load_buildings(tile_id: str, prefer=("lod22_2d", "lod13_2d", "lod12_2d")) -> gpd.GeoDataFrame:
+@st.cache_data(show_spinner=False)
+def load_buildings(tile_id: str, cache_tag=None, prefer=("lod22_2d", "lod13_2d", "lod12_2d")) -> gpd.GeoDataFrame:
     gpkg = MESH_ROOT / tile_id / f"{tile_id}.gpkg"
     if not gpkg.exists():
         return gpd.GeoDataFrame(geometry=[])
-    for layer in prefer:
-        try:
-            g = gpd.read_file(gpkg, layer=layer, engine="fiona").to_crs(4326)
-            g["layer"] = layer
-            return g
-        except Exception:
-            continue
+    # One metadata open to pick the layer, then a single read; no speculative per-layer attempts
     try:
-        return gpd.read_file(gpkg, engine="fiona").to_crs(4326)
-    except Exception:
+        available = [str(name) for name in pyogrio.list_layers(gpkg)[:, 0]]
+    except DataSourceError:
+        return gpd.GeoDataFrame(geometry=[])
+    layer = next((l for l in prefer if l in available), available[0] if available else None)
+    if layer is None:
         return gpd.GeoDataFrame(geometry=[])
+    # Only footprints are drawn, so skip every attribute column
+    g = gpd.read_file(gpkg, layer=layer, columns=[], engine="pyogrio", use_arrow=True).to_crs(4326)
+    g["layer"] = layer
+    return g
 
 
-def load_mapillary_points(tile_id: str) -> pd.DataFrame:
+@st.cache_data(show_spinner=False)
+def load_mapillary_points(tile_id: str, cache_tag=None) -> pd.DataFrame:
     base = MAP_ROOT / tile_id
     for name in ("meta_clean.parquet", "meta_28992.parquet"):
         p = base / name
         if p.exists():
-            df = pd.read_parquet(p)
+            present = set(pq.read_schema(p).names)
+            df = pd.read_parquet(p, columns=[c for c in POINT_COLUMNS if c in present], engine="pyarrow")
             # Ensure lon/lat for web map
             if not {"lon", "lat"}.issubset(df.columns):
                 if {"x_28992", "y_28992"}.issubset(df.columns):
-                    t = Transformer.from_crs(28992, 4326, always_xy=True)
+                    t = _transformer(28992, 4326)
                     lon, lat = t.transform(df["x_28992"].values, df["y_28992"].values)
                     df["lon"], df["lat"] = lon, lat
                 else:
@@ -87,36 +142,55 @@ def load_mapillary_points(tile_id: str) -> pd.DataFrame:
             # Local thumbnail path
             img_dir = base / "images"
             if img_dir.exists():
-                df["thumb_local"] = df["id"].astype(str).map(lambda i: str((img_dir / f"{i}.jpg").resolve()))
+                prefix = str(img_dir.resolve()) + os.sep
+                df["thumb_local"] = np.char.add(np.char.add(prefix, df["id"].astype(str).to_numpy(dtype=str)), ".jpg")
             else:
                 df["thumb_local"] = None
             return df
     return pd.DataFrame(columns=["id", "lon", "lat"])
 
 
-def tile_center_from_manifest(tile_id: str):
+@st.cache_data(show_spinner=False)
+def tile_center_from_manifest(tile_id: str, cache_tag=None):
+    """
+    (lat, lon) map center, cached per (tile, input mtimes): a tile opened before its manifest or
+    buildings exist gets the city-center fallback, which must not outlive their arrival.
+    """
     man = load_manifest(tile_id)
     wkt = man.get("tile_polygon_wkt")
     if wkt:
         g = gpd.GeoSeries.from_wkt([wkt], crs=28992).to_crs(4326)
         c = g.iloc[0].centroid
         return c.y, c.x
-    b = load_buildings(tile_id)
+    b = load_buildings(tile_id, cache_tag)
     if not b.empty:
-        if hasattr(b, "union_all"):
-            c = b.union_all().centroid
-        else:
-            c = b.unary_union.centroid  # fallback for older Shapely
-        return c.y, c.x
+        # bbox center is as good as a dissolved centroid for placing the viewport, without the union
+        minx, miny, maxx, maxy = b.total_bounds
+        return (miny + maxy) / 2, (minx + maxx) / 2
     return (52.3728, 4.8936)
 
 
 def encode_thumb_base64(path: str, max_w: int = 320) -> str | None:
     p = Path(path)
-    if not p.exists():
+    try:
+        mtime = p.stat().st_mtime
+    except OSError:
         return None
+    return _encode_thumb_cached(str(p), mtime, max_w)
+
+
+@lru_cache(maxsize=4096)
+def _encode_thumb_cached(path: str, mtime: float, max_w: int) -> str | None:
+    """Keyed on mtime so re-downloaded images are re-encoded; small JPEGs are passed through as-is."""
     try:
-        im = Image.open(p).convert("RGB")
+        raw = Path(path).read_bytes()
+        im = Image.open(BytesIO(raw))  # header only until pixels are needed
+        w, h = im.size
+        if w <= max_w and im.format == "JPEG" and im.mode == "RGB":
+            return base64.b64encode(raw).decode("ascii")
+        if w > max_w:
+            im.draft("RGB", (max_w, int(h * (max_w / w))))  # JPEG DCT-domain downscale
+        im = im.convert("RGB")
         w, h = im.size
         if w > max_w:
             im = im.resize((max_w, int(h * (max_w / w))))
@@ -127,32 +201,80 @@ def encode_thumb_base64(path: str, max_w: int = 320) -> str | None:
         return None
 
 
-def haversine_deg(lat1, lon1, lat2, lon2):
-    """Great-circle distance in meters between points in degrees."""
-    R = 6371000.0
-    p1 = np.radians(lat1); p2 = np.radians(lat2)
-    dlat = p2 - p1
-    dlon = np.radians(lon2 - lon1)
-    a = np.sin(dlat/2)**2 + np.cos(p1)*np.cos(p2)*np.sin(dlon/2)**2
-    return 2 * R * np.arcsin(np.sqrt(a))
+# Metres per degree of latitude / of longitude at the equator (local equirectangular approximation)
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0
 
 
 def nearest_point(df: pd.DataFrame, lat: float, lon: float, max_dist_m: float = 25.0):
-    """Return (row, dist_m) of nearest Mapillary record to clicked lat/lon within max distance."""
+    """
+    Return (row, dist_m) of nearest Mapillary record to clicked lat/lon within max distance.
+    Planar approximation: within a few decimetres of haversine at click range, no trig per point.
+    """
     if df.empty or not {"lat", "lon"}.issubset(df.columns):
         return None, None
     coords = df[["lat", "lon"]].to_numpy(dtype=float)
-    dists = haversine_deg(lat, lon, coords[:, 0], coords[:, 1])
-    idx = int(np.argmin(dists))
-    d = float(dists[idx])
+    dx = (coords[:, 1] - lon) * (np.cos(np.radians(lat)) * M_PER_DEG_LON)
+    dy = (coords[:, 0] - lat) * M_PER_DEG_LAT
+    d2 = dx * dx + dy * dy
+    if not np.isfinite(d2).any():
+        return None, None
+    idx = int(np.nanargmin(d2))
+    d = float(np.sqrt(d2[idx]))
     if d <= max_dist_m:
         return df.iloc[idx], d
     return None, None
 
 
 # ----------------------------- Folium map -----------------------------
-def build_folium_map(tile_id: str, buildings: gpd.GeoDataFrame, cams: pd.DataFrame, zoom=16):
-    center = tile_center_from_manifest(tile_id)
+def buildings_to_geojson(buildings: gpd.GeoDataFrame) -> str:
+    """Attribute-free FeatureCollection string of display-simplified footprints (EPSG:4326)."""
+    geoms = buildings.geometry
+    geoms = geoms[geoms.notna() & ~geoms.is_empty]
+    geoms = shapely.simplify(np.asarray(geoms.values), DISPLAY_SIMPLIFY_DEG, preserve_topology=True)
+    features = ",".join('{"type":"Feature","properties":{},"geometry":%s}' % g for g in shapely.to_geojson(geoms))
+    return '{"type":"FeatureCollection","features":[%s]}' % features
+
+
+def _prebuilt_geojson(tile_id: str) -> Path | None:
+    """Pre-built viewer GeoJSON for the tile, unless missing or older than the tile's GPKG."""
+    pre = MESH_ROOT / tile_id / BUILDINGS_GEOJSON
+    gpkg = MESH_ROOT / tile_id / f"{tile_id}.gpkg"
+    if not pre.exists():
+        return None
+    if gpkg.exists() and pre.stat().st_mtime < gpkg.stat().st_mtime:
+        return None  # stale: rebuilt from the GPKG instead
+    return pre
+
+
+def _geojson_layer(pre: Path) -> str | None:
+    """Layer name of a pre-built GeoJSON, from its sidecar (no parse of the collection itself)."""
+    try:
+        name = json.loads(pre.with_name(BUILDINGS_GEOJSON_META).read_text()).get("layer")
+    except (OSError, ValueError, AttributeError):
+        return None
+    return str(name) if name else None
+
+
+def buildings_geojson_for(tile_id: str, cache_tag=None) -> tuple[str | None, str]:
+    """(FeatureCollection string, layer label); serialized once per tile and kept in session_state."""
+    key = f"gj_{tile_id}"
+    hit = st.session_state.get(key)
+    pre = _prebuilt_geojson(tile_id) if hit is None or hit[0] != cache_tag else None
+    if pre is not None:
+        # Written by scripts/build_buildings_geojson.py: already simplified and in EPSG:4326
+        hit = st.session_state[key] = (cache_tag, pre.read_text(), _geojson_layer(pre) or "2D")
+    if hit is None or hit[0] != cache_tag:
+        b = load_buildings(tile_id, cache_tag)
+        geojson = buildings_to_geojson(b) if not b.empty else None
+        label = str(b["layer"].iloc[0]) if "layer" in b.columns and len(b) > 0 else "2D"
+        hit = st.session_state[key] = (cache_tag, geojson, label)
+    return hit[1], hit[2]
+
+
+def build_folium_map(tile_id: str, buildings_geojson: str | None, buildings_label: str, cams: pd.DataFrame, zoom=16,
+                     cache_tag=None):
+    center = tile_center_from_manifest(tile_id, cache_tag)
     m = folium.Map(location=center, zoom_start=zoom, tiles=None, control_scale=True)
 
     # PDOK aerial base
@@ -166,69 +288,147 @@ def build_folium_map(tile_id: str, buildings: gpd.GeoDataFrame, cams: pd.DataFra
     ).add_to(m)
 
     # Buildings overlay
-    if not buildings.empty:
+    if buildings_geojson:
         gj = folium.GeoJson(
-            data=json.loads(buildings.to_json()),
-            name=f"Buildings ({buildings.get('layer', 'lod22_2d').iloc[0] if 'layer' in buildings.columns and len(buildings)>0 else '2D'})",
+            data=buildings_geojson,
+            name=f"Buildings ({buildings_label})",
             style_function=lambda feat: {"color": "#000000", "weight": 1, "fill": False},
             control=True,
         )
         gj.add_to(m)
 
-    # Mapillary points (clustered) — popup contains inline base64 thumbnail
+    # Mapillary points (clustered) — markers are built client-side from one JSON array
     if not cams.empty and {"lon", "lat"}.issubset(cams.columns):
-        cams_ok = cams.dropna(subset=["lon", "lat"]).copy()
-        mc = MarkerCluster(name="Mapillary").add_to(m)
-        for _, r in cams_ok.iterrows():
-            b64 = encode_thumb_base64(str(r.get("thumb_local"))) if r.get("thumb_local") else None
-            if b64:
-                popup_html = f"<img src='data:image/jpeg;base64,{b64}' width='320'/>"
-            else:
-                popup_html = f"<b>ID:</b> {r.get('id','?')}"
-                if r.get("captured_at_utc"):
-                    popup_html += f"<br><b>Time:</b> {r.get('captured_at_utc')}"
-            folium.Marker(
-                location=(float(r["lat"]), float(r["lon"])),
-                icon=folium.Icon(color="red", icon="camera", prefix="fa"),
-                popup=folium.Popup(popup_html, max_width=340),
-                tooltip=str(r.get("id", "")),
-            ).add_to(mc)
+        cams_ok = cams.dropna(subset=["lon", "lat"])
+        ids = cams_ok["id"].astype(str).tolist() if "id" in cams_ok.columns else ["?"] * len(cams_ok)
+        times = (
+            cams_ok["captured_at_utc"].fillna("").astype(str).tolist()
+            if "captured_at_utc" in cams_ok.columns else [""] * len(cams_ok)
+        )
+        thumbs = cams_ok["thumb_local"].tolist() if "thumb_local" in cams_ok.columns else [None] * len(cams_ok)
+        b64s = [encode_thumb_base64(str(t)) if t else None for t in thumbs]
+        popups = [
+            f"<img src='data:image/jpeg;base64,{b64}' width='320'/>" if b64
+            else f"<b>ID:</b> {i}" + (f"<br><b>Time:</b> {t}" if t else "")
+            for i, t, b64 in zip(ids, times, b64s)
+        ]
+        latlon = cams_ok[["lat", "lon"]].to_numpy(dtype=float).tolist()
+        rows = [[lat, lon, p, i] for (lat, lon), p, i in zip(latlon, popups, ids)]
+        FastMarkerCluster(rows, callback=MARKER_CALLBACK_JS, name="Mapillary").add_to(m)
 
     folium.LayerControl(collapsed=False).add_to(m)
     return m
 
 
-# ----------------------------- Mesh snapshot (matplotlib) -----------------------------
-def render_mesh_snapshot_matplotlib(tile_id: str, lod="LoD22", width=900, height=700, elev=25, azim=-60):
+@st.cache_resource(show_spinner="Building map…")
+def get_folium_map(tile_id: str, cache_tag=None, zoom=16, _buildings=(None, "2D")):
+    """
+    Build the folium map once per (tile, input mtimes) and pre-render its HTML.
+    `_buildings` is the (geojson, label) pair; the leading underscore keeps it out of the cache key.
+    """
+    cams = load_mapillary_points(tile_id, cache_tag)
+    m = build_folium_map(tile_id, _buildings[0], _buildings[1], cams, zoom=zoom, cache_tag=cache_tag)
+    m.get_root().render()
+    return m
+
+
+@st.cache_data(show_spinner=False)
+def get_map_html(tile_id: str, cache_tag=None, zoom=16, _buildings=(None, "2D")) -> str:
+    """Full standalone HTML page of the cached map, for the static (no-rerun) display mode."""
+    return get_folium_map(tile_id, cache_tag, zoom=zoom, _buildings=_buildings).get_root().render()
+
+
+# ----------------------------- Mesh snapshot -----------------------------
+def _load_lod_mesh(tile_id: str, lod: str):
+    """Return (Trimesh, None) for the first OBJ in the LoD folder, or (None, error message)."""
     obj_dir = MESH_ROOT / tile_id / "obj" / lod
     if not obj_dir.exists():
         return None, f"No {lod} directory found."
     objs = sorted(obj_dir.glob("*.obj"))
     if not objs:
         return None, f"No OBJ files found in {obj_dir}"
-    obj_path = objs[0]
+    mesh = trimesh.load_mesh(objs[0], force="mesh")
+    if hasattr(mesh, "geometry"):  # Scene
+        parts = [g for g in mesh.geometry.values() if isinstance(g, trimesh.Trimesh)]
+        if not parts:
+            return None, "No Trimesh geometries found in scene."
+        mesh = trimesh.util.concatenate(parts)
+    if not isinstance(mesh, trimesh.Trimesh):
+        return None, "Loaded mesh is not a Trimesh."
+    return mesh, None
+
+
+def _normalized_vertices(verts: np.ndarray) -> np.ndarray:
+    """Center on the mean and scale so 95% of vertices fall inside the unit sphere."""
+    v = verts - verts.mean(axis=0)
+    scale = np.percentile(np.linalg.norm(v, axis=1), 95)
+    if scale > 0:
+        v /= scale
+    return v
+
+
+def _snapshot_path(tile_id: str, lod: str, elev, azim) -> Path:
+    out_dir = Path("outputs/mesh_snapshots") / tile_id
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return out_dir / f"{lod}_e{elev}_a{azim}.png"
+
+
+def _camera_pose(elev, azim, distance: float) -> np.ndarray:
+    """Camera-to-world pose looking at the origin, +Z up, using matplotlib's elev/azim convention."""
+    e, a = np.radians(elev), np.radians(azim)
+    eye = distance * np.array([np.cos(e) * np.cos(a), np.cos(e) * np.sin(a), np.sin(e)])
+    z = eye / np.linalg.norm(eye)
+    x = np.cross([0.0, 0.0, 1.0], z)
+    x = x / np.linalg.norm(x) if np.linalg.norm(x) > 1e-9 else np.array([1.0, 0.0, 0.0])
+    pose = np.eye(4)
+    pose[:3, 0], pose[:3, 1], pose[:3, 2], pose[:3, 3] = x, np.cross(z, x), z, eye
+    return pose
+
+
+def render_mesh_snapshot_pyrender(tile_id: str, lod="LoD22", width=900, height=700, elev=25, azim=-60):
+    """Offscreen GL rasterization; raises if pyrender or an OSMesa/EGL backend is unavailable."""
+    mesh, err = _load_lod_mesh(tile_id, lod)
+    if err:
+        return None, err
+    if not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        # Headless: software GL; must be set before OpenGL is imported
+        os.environ.setdefault("PYOPENGL_PLATFORM", "osmesa")
+    import pyrender
+
+    tm = trimesh.Trimesh(vertices=_normalized_vertices(mesh.vertices), faces=mesh.faces, process=False)
+    material = pyrender.MetallicRoughnessMaterial(
+        baseColorFactor=(0.82, 0.84, 0.9, 1.0), metallicFactor=0.0, roughnessFactor=0.9
+    )
+    scene = pyrender.Scene(bg_color=(1.0, 1.0, 1.0, 1.0), ambient_light=(0.35, 0.35, 0.35))
+    scene.add(pyrender.Mesh.from_trimesh(tm, material=material, smooth=False))
+    pose = _camera_pose(elev, azim, distance=3.5)
+    scene.add(pyrender.PerspectiveCamera(yfov=np.radians(40.0), aspectRatio=width / height), pose=pose)
+    scene.add(pyrender.DirectionalLight(color=np.ones(3), intensity=3.0), pose=pose)
+
+    renderer = pyrender.OffscreenRenderer(width, height)
+    try:
+        color, _ = renderer.render(scene)
+    finally:
+        renderer.delete()
+    out_path = _snapshot_path(tile_id, lod, elev, azim)
+    Image.fromarray(color).save(out_path)
+    return str(out_path), None
+
 
+def render_mesh_snapshot_matplotlib(tile_id: str, lod="LoD22", width=900, height=700, elev=25, azim=-60):
     try:
-        mesh = trimesh.load_mesh(obj_path, force="mesh")
-        if hasattr(mesh, "geometry"):  # Scene
-            parts = [g for g in mesh.geometry.values() if isinstance(g, trimesh.Trimesh)]
-            if not parts:
-                return None, "No Trimesh geometries found in scene."
-            mesh = trimesh.util.concatenate(parts)
-        if not isinstance(mesh, trimesh.Trimesh):
-            return None, "Loaded mesh is not a Trimesh."
-
-        verts = mesh.vertices
-        faces = mesh.faces
-
-        # center & normalize
-        center = verts.mean(axis=0)
-        v = verts - center
-        scale = np.percentile(np.linalg.norm(v, axis=1), 95)
-        if scale > 0:
-            v /= scale
-
-        tris = v[faces]
+        mesh, err = _load_lod_mesh(tile_id, lod)
+        if err:
+            return None, err
+
+        # Most LoD22 faces are sub-pixel at snapshot size; decimate before matplotlib touches them
+        if len(mesh.faces) > MPL_MAX_FACES:
+            try:
+                mesh = mesh.simplify_quadric_decimation(face_count=MPL_MAX_FACES)
+            except Exception:
+                pass  # no simplification backend (fast-simplification/open3d); render full mesh
+        v = _normalized_vertices(mesh.vertices).astype(np.float32)
+        tris = v[mesh.faces]
 
         fig = plt.figure(figsize=(width/100, height/100), dpi=100)
         ax = fig.add_subplot(111, projection="3d")
@@ -239,9 +439,7 @@ def render_mesh_snapshot_matplotlib(tile_id: str, lod="LoD22", width=900, height
         ax.set_axis_off()
         ax.view_init(elev=elev, azim=azim)
 
-        out_dir = Path("outputs/mesh_snapshots") / tile_id
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_path = out_dir / f"{lod}.png"
+        out_path = _snapshot_path(tile_id, lod, elev, azim)
         fig.savefig(out_path, bbox_inches="tight", pad_inches=0)
         plt.close(fig)
         return str(out_path), None
@@ -249,6 +447,16 @@ def render_mesh_snapshot_matplotlib(tile_id: str, lod="LoD22", width=900, height
         return None, f"Failed to render mesh: {e}"
 
 
+@st.cache_data(show_spinner="Rendering…")
+def render_mesh_snapshot(tile_id: str, lod="LoD22", elev=25, azim=-60, cache_tag=None):
+    """GPU/OSMesa render when available, matplotlib otherwise. Returns (png_path, error)."""
+    try:
+        return render_mesh_snapshot_pyrender(tile_id, lod=lod, elev=elev, azim=azim)
+    except Exception as e:
+        print(f"[w] pyrender snapshot failed ({type(e).__name__}: {e}); falling back to matplotlib")
+        return render_mesh_snapshot_matplotlib(tile_id, lod=lod, elev=elev, azim=azim)
+
+
 # ----------------------------- UI -----------------------------
 tiles = list_tiles()
 if not tiles:
@@ -257,18 +465,38 @@ if not tiles:
 
 default_idx = tiles.index("10-430-720") if "10-430-720" in tiles else 0
 tile_id = st.sidebar.selectbox("Tile", tiles, index=default_idx)
+# Click-to-select stays the default; turning it off embeds the cached HTML directly, so
+# panning/zooming never triggers a Streamlit rerun (but the Selection panel gets no clicks).
+interactive_map = st.sidebar.toggle("Click-to-select on map", value=True,
+                                    help="Uses st_folium round-trips to feed the Selection panel. "
+                                         "Turn off for a faster static map without selection.")
 
 tab_map, tab_mesh = st.tabs(["🗺️ Map (Folium + PDOK)", "🧱 3D Mesh Preview"])
 
 # ----------------------------- Map tab -----------------------------
 with tab_map:
     st.subheader("Aerial + Buildings + Mapillary")
-    buildings = load_buildings(tile_id)
-    cams = load_mapillary_points(tile_id)
-    fmap = build_folium_map(tile_id, buildings, cams, zoom=16)
-
-    # Capture map interactions
-    map_state = st_folium(fmap, width=None, height=700, returned_objects=[])
+    cache_tag = tile_cache_tag(tile_id)
+    cams = load_mapillary_points(tile_id, cache_tag)
+    buildings_gj = buildings_geojson_for(tile_id, cache_tag)
+
+    if interactive_map:
+        # Capture map interactions
+        fmap = get_folium_map(tile_id, cache_tag, zoom=16, _buildings=buildings_gj)
+        map_state = st_folium(fmap, width=None, height=700,
+                              returned_objects=["last_object_clicked", "last_map_click"])
+    else:
+        st_html(get_map_html(tile_id, cache_tag, zoom=16, _buildings=buildings_gj), height=700, scrolling=False)
+        map_state = None
+
+    # Resolve the clicked point once; both columns below reuse it.
+    # Markers usually populate 'last_object_clicked' in recent streamlit-folium;
+    # otherwise, fall back to 'last_map_click'
+    clicked = (map_state.get("last_object_clicked") or map_state.get("last_map_click")) if map_state else None
+    has_click = bool(clicked and "lat" in clicked and "lng" in clicked)
+    row, dist_m = None, None
+    if has_click:
+        row, dist_m = nearest_point(cams, float(clicked["lat"]), float(clicked["lng"]), max_dist_m=35.0)
 
     # Side details panel on click
     st.markdown("### Selection")
@@ -276,12 +504,7 @@ with tab_map:
 
     with col_l:
         if map_state:
-            # Markers usually populate 'last_object_clicked' in recent streamlit-folium;
-            # otherwise, fall back to 'last_map_click'
-            clicked = map_state.get("last_object_clicked") or map_state.get("last_map_click")
-            if clicked and "lat" in clicked and "lng" in clicked:
-                clat, clon = float(clicked["lat"]), float(clicked["lng"])
-                row, dist_m = nearest_point(cams, clat, clon, max_dist_m=35.0)
+            if has_click:
                 if row is not None:
                     st.write(f"**Nearest point** (≈{dist_m:.1f} m)")
                     # Show key metadata
@@ -294,29 +517,29 @@ with tab_map:
                     st.info("Click near a pin to see details here.")
             else:
                 st.info("Click a pin (or near one) on the map to see details.")
-        else:
+        elif interactive_map:
             st.info("Interact with the map to select a point.")
+        else:
+            st.info("Enable 'Click-to-select on map' in the sidebar to inspect points here.")
 
     with col_r:
         # Larger image preview (from the selected/nearest row)
-        if map_state:
-            clicked = map_state.get("last_object_clicked") or map_state.get("last_map_click")
-            if clicked and "lat" in clicked and "lng" in clicked:
-                clat, clon = float(clicked["lat"]), float(clicked["lng"])
-                row, _ = nearest_point(cams, clat, clon, max_dist_m=35.0)
-                if row is not None and row.get("thumb_local") and Path(str(row.get("thumb_local"))).exists():
-                    st.image(str(row.get("thumb_local")), caption=f"id: {row.get('id')}", use_container_width=True)
-                else:
-                    st.info("No local thumbnail for this point.")
+        if has_click:
+            if row is not None and row.get("thumb_local") and Path(str(row.get("thumb_local"))).exists():
+                st.image(str(row.get("thumb_local")), caption=f"id: {row.get('id')}", use_container_width=True)
+            else:
+                st.info("No local thumbnail for this point.")
 
 # ----------------------------- Mesh tab -----------------------------
 with tab_mesh:
-    st.subheader("LoD OBJ snapshot (CPU-only)")
+    st.subheader("LoD OBJ snapshot")
     lod = st.selectbox("LoD folder", ["LoD22", "LoD13", "LoD12"], index=0)
     elev = st.slider("Elevation", 0, 80, 25)
     azim = st.slider("Azimuth", -180, 180, -60)
     if st.button("Render snapshot"):
-        png_path, err = render_mesh_snapshot_matplotlib(tile_id, lod=lod, elev=elev, azim=azim)
+        obj_dir = MESH_ROOT / tile_id / "obj" / lod
+        mesh_tag = obj_dir.stat().st_mtime if obj_dir.exists() else None
+        png_path, err = render_mesh_snapshot(tile_id, lod=lod, elev=elev, azim=azim, cache_tag=mesh_tag)
         if err:
             st.error(err)
         elif png_path:
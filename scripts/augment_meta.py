@@ -2,14 +2,42 @@
 import json
 import argparse
 from pathlib import Path
-from datetime import datetime, timezone
 
 import pandas as pd
-from pyproj import Transformer
+import pyarrow as pa
+import pyarrow.json as paj
 import geopandas as gpd
 
+from scripts.utils_crs import get_transformer
 
-def _read_jsonl(path: Path) -> list[dict]:
+PARQUET_ROW_GROUP = 50_000
+JSONL_STRING_COLUMNS = ["id"]
+
+
+def _read_arrow_jsonl(path: Path, string_columns) -> pa.Table:
+    schema = pa.schema([(c, pa.string()) for c in string_columns])
+    table = paj.read_json(path, read_options=paj.ReadOptions(block_size=8 << 20),
+                          parse_options=paj.ParseOptions(explicit_schema=schema,
+                                                         unexpected_field_behavior="infer"))
+    # explicit fields absent from the file come back as all-null columns: drop them
+    absent = [c for c in string_columns if table.column(c).null_count == table.num_rows]
+    return table.drop_columns(absent)
+
+
+def _read_jsonl(path: Path) -> pd.DataFrame:
+    """
+    Bulk-parse JSONL with Arrow; fall back to a tolerant line loop on mixed schemas or bad lines.
+    id is pinned to string. captured_at is inferred (the Graph API gives epoch-ms integers), but
+    if Arrow turns ISO strings into timestamps it is re-read as string, so the original text is
+    kept and _parse_timestamps doesn't misread datetimes as epoch ms.
+    """
+    try:
+        table = _read_arrow_jsonl(path, JSONL_STRING_COLUMNS)
+        if "captured_at" in table.column_names and pa.types.is_timestamp(table.schema.field("captured_at").type):
+            table = _read_arrow_jsonl(path, JSONL_STRING_COLUMNS + ["captured_at"])
+        return table.to_pandas()
+    except (pa.ArrowInvalid, OSError) as e:
+        print(f"[w] Arrow JSONL read failed for {path} ({e}); falling back to line-by-line parsing")
     rows = []
     with open(path, "r") as f:
         for line in f:
@@ -20,33 +48,33 @@ def _read_jsonl(path: Path) -> list[dict]:
                 rows.append(json.loads(line))
             except json.JSONDecodeError:
                 continue
-    return rows
-
-
-def _parse_timestamp(ts):
-    """Return ISO8601 UTC string if possible, else original value."""
-    if ts is None or ts == "":
-        return None
-    try:
-        if isinstance(ts, (int, float)) or (isinstance(ts, str) and ts.isdigit()):
-            ms = int(ts)
-            dt = datetime.fromtimestamp(ms / 1000.0, tz=timezone.utc)
-            return dt.isoformat()
-        dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc).isoformat()
-    except Exception:
-        return ts
-
-
-def main():
+    return pd.DataFrame(rows)
+
+
+def _parse_timestamps(s: pd.Series) -> pd.Series:
+    """
+    Vectorized: ISO8601 UTC strings (as datetime.isoformat() renders them) for epoch-ms numbers
+    or ISO strings. Unparseable values are kept as-is; missing/empty values become None.
+    """
+    num = pd.to_numeric(s, errors="coerce")
+    dt = pd.to_datetime(num, unit="ms", utc=True, errors="coerce")
+    rest = num.isna() & s.notna()
+    if rest.any():
+        dt[rest] = pd.to_datetime(s[rest].astype(str), utc=True, errors="coerce", format="mixed")
+    frac = dt.dt.strftime(".%f").where(dt.dt.microsecond != 0, "")
+    iso = dt.dt.strftime("%Y-%m-%dT%H:%M:%S") + frac + "+00:00"
+    out = iso.where(dt.notna(), s).astype(object)
+    out[s.isna() | (s.astype(str) == "")] = None
+    return out
+
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--tile-id", required=True, help="e.g., 10-430-720")
     ap.add_argument("--map-root", default="data/amsterdam/mapillary", help="Directory where meta.jsonl lives")
     ap.add_argument("--write-geo", action="store_true", help="Also write GeoParquet with geometry column")
     ap.add_argument("--overwrite", action="store_true", help="Overwrite outputs if they exist")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     tile = args.tile_id
     tile_dir = Path(args.map_root) / tile
@@ -64,49 +92,53 @@ def main():
         print("[i] Outputs exist. Use --overwrite to regenerate.")
         return
 
-    rows = _read_jsonl(meta_jsonl)
-    if not rows:
+    df = _read_jsonl(meta_jsonl)
+    if df.empty:
         raise SystemExit(f"No valid rows in {meta_jsonl}")
 
-    df = pd.DataFrame(rows)
     if "id" not in df.columns:
         raise SystemExit("Expected an 'id' column in meta.jsonl.")
     if not {"lon", "lat"}.issubset(df.columns):
         raise SystemExit("Expected 'lon' and 'lat' columns in meta.jsonl.")
 
+    # dropna(lon/lat) then dedup(id) as one mask: invalid rows don't shadow a later valid duplicate
     before = len(df)
-    df = df.dropna(subset=["lon", "lat"])
-    after_drop = len(df)
-    df = df.drop_duplicates(subset=["id"], keep="first")
+    has_coords = df["lon"].notna() & df["lat"].notna()
+    keep = has_coords & ~df["id"].where(has_coords).duplicated(keep="first")
+    after_drop = int(has_coords.sum())
+    df = df.loc[keep].reset_index(drop=True)
     after_dedup = len(df)
 
-    tr = Transformer.from_crs("EPSG:4326", "EPSG:28992", always_xy=True)
+    tr = get_transformer("EPSG:4326", "EPSG:28992")
     x, y = tr.transform(df["lon"].astype(float).values, df["lat"].astype(float).values)
     df["x_28992"] = x
     df["y_28992"] = y
 
     if "captured_at" in df.columns:
-        df["captured_at_utc"] = df["captured_at"].map(_parse_timestamp)
+        df["captured_at_utc"] = _parse_timestamps(df["captured_at"])
 
     # JSONL (projected)
-    with open(out_jsonl, "w") as f:
-        for rec in df.to_dict(orient="records"):
-            f.write(json.dumps(rec) + "\n")
+    df.to_json(out_jsonl, orient="records", lines=True)
 
-    # Parquet (fast)
+    # Parquet (fast); pyarrow dictionary-encodes repetitive columns by default
     try:
-        df.to_parquet(out_parquet, index=False)
+        df.to_parquet(out_parquet, index=False, engine="pyarrow", compression="snappy",
+                      row_group_size=PARQUET_ROW_GROUP)
     except Exception as e:
-        print(f"[w] Could not write Parquet ({e}). Install pyarrow or fastparquet to enable Parquet export.")
+        print(f"[w] Could not write Parquet ({e}). Install pyarrow to enable Parquet export.")
         out_parquet = None
 
     # Optional GeoParquet
     if args.write_geo:
         gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["x_28992"], df["y_28992"]), crs="EPSG:28992")
         try:
-            gdf.to_parquet(out_geoparquet, index=False)
+            # Per-row bbox column lets readers skip row groups outside a query window; native
+            # GeoArrow point encoding (x/y struct) lets readers skip the WKB decode
+            gdf.to_parquet(out_geoparquet, index=False, compression="snappy", write_covering_bbox=True,
+                           geometry_encoding="geoarrow")
         except Exception as e:
             print(f"[w] Could not write GeoParquet ({e}).")
+            out_geoparquet = None
 
     print(f"[i] Input rows: {before}")
     print(f"[i] Kept after dropna(lon/lat): {after_drop}")
@@ -114,7 +146,7 @@ def main():
     print(f"[i] Wrote {out_jsonl}")
     if out_parquet:
         print(f"[i] Wrote {out_parquet}")
-    if args.write_geo:
+    if args.write_geo and out_geoparquet:
         print(f"[i] Wrote {out_geoparquet}")
 
 if __name__ == "__main__":
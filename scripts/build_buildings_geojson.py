@@ -0,0 +1,68 @@
+# scripts/build_buildings_geojson.py
+import argparse
+import json
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import shapely
+
+PREFERRED_LAYERS = ("lod22_2d", "lod13_2d", "lod12_2d")
+OUT_NAME = "buildings_4326.geojson"
+OUT_META_NAME = "buildings_4326.meta.json"  # {"layer": ..., "features": ...} sidecar for the viewer
+
+
+def write_buildings_geojson(gpkg_path: Path, out_path: Path, layer: str | None = None, tolerance_m: float = 0.5) -> int:
+    """
+    Simplify footprints in EPSG:28992, reproject to EPSG:4326 and write an attribute-free
+    FeatureCollection the viewer can load verbatim. The layer name is stored as a top-level
+    "name" member and in a small OUT_META_NAME sidecar next to out_path, so readers get it
+    without parsing the collection. Returns the number of features written.
+    """
+    if layer is None:
+        available = [str(n) for n in pyogrio.list_layers(gpkg_path)[:, 0]]
+        layer = next((l for l in PREFERRED_LAYERS if l in available), available[0] if available else None)
+        if layer is None:
+            raise SystemExit(f"No layers in {gpkg_path}")
+
+    g = gpd.read_file(gpkg_path, layer=layer, columns=[], engine="pyogrio", use_arrow=True)
+    g = g.to_crs("EPSG:28992")
+    g = g[g.geometry.notna() & ~g.geometry.is_empty]
+    geoms = shapely.simplify(np.asarray(g.geometry.values), tolerance_m, preserve_topology=True)
+    geoms = gpd.GeoSeries(geoms, crs="EPSG:28992").to_crs("EPSG:4326")
+
+    features = ",".join(
+        '{"type":"Feature","properties":{},"geometry":%s}' % s
+        for s in shapely.to_geojson(np.asarray(geoms.values))
+    )
+    out_path.write_text('{"type":"FeatureCollection","name":%s,"features":[%s]}' % (json.dumps(layer), features))
+    out_path.with_name(OUT_META_NAME).write_text(json.dumps({"layer": layer, "features": len(geoms)}))
+    return len(geoms)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pre-simplify building footprints into a viewer-ready GeoJSON.")
+    ap.add_argument("--tile-id", required=True, help="e.g., 10-430-720")
+    ap.add_argument("--mesh-root", default="data/amsterdam/mesh", help="Directory where the GPKG lives")
+    ap.add_argument("--layer", default=None, help=f"GPKG layer (default: first of {', '.join(PREFERRED_LAYERS)})")
+    ap.add_argument("--tolerance-m", type=float, default=0.5,
+                    help="Simplification tolerance in meters (0.5 m is sub-pixel at zoom 16)")
+    ap.add_argument("--overwrite", action="store_true", help="Overwrite output if it exists")
+    args = ap.parse_args(argv)
+
+    tile = args.tile_id
+    gpkg = Path(args.mesh_root) / tile / f"{tile}.gpkg"
+    if not gpkg.exists():
+        raise SystemExit(f"Missing GPKG: {gpkg}")
+    out_path = gpkg.parent / OUT_NAME
+    if out_path.exists() and not args.overwrite:
+        print(f"[i] {out_path} exists. Use --overwrite to regenerate.")
+        return
+
+    n = write_buildings_geojson(gpkg, out_path, layer=args.layer, tolerance_m=args.tolerance_m)
+    print(f"[i] Wrote {out_path} ({n} footprints)")
+
+
+if __name__ == "__main__":
+    main()
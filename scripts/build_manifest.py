@@ -1,42 +1,97 @@
 # scripts/build_manifest.py
 import argparse
+import hashlib
 import json
+import os
+import re
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 
-import geopandas as gpd
+import numpy as np
 import pandas as pd
-import fiona
+import pyarrow.parquet as pq
+import pyogrio
 
-from scripts.tiles import tile_polygon
+from scripts.tiles import DEFAULT_TILE_INDEX, tile_polygon
+from scripts.utils_crs import get_transformer, horizontal_crs, is_rd_new
+from scripts.utils_json import dumps
+
+PROBE_WORKERS = 8
+# captured_at_utc as augment_meta writes it; these strings sort chronologically
+ISO_UTC_RE = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?\+00:00$")
 
 def list_layers_safely(gpkg_path: Path) -> list[str]:
     try:
-        return list(fiona.listlayers(gpkg_path))
+        return [str(name) for name in pyogrio.list_layers(gpkg_path)[:, 0]]
     except Exception:
         return []
 
+def _minmax_from_stats(md: pq.FileMetaData, name: str):
+    """
+    (min, max) of a column from the row-group statistics in the footer — no data pages read.
+    Returns None if any non-empty row group lacks min/max stats; (None, None) if all values are null.
+    """
+    j = md.schema.names.index(name)
+    lo, hi = [], []
+    for i in range(md.num_row_groups):
+        rg = md.row_group(i)
+        st = rg.column(j).statistics
+        if st is not None and st.has_min_max:
+            lo.append(st.min); hi.append(st.max)
+        elif not (st is not None and st.has_null_count and st.null_count == rg.num_rows):
+            return None
+    return (min(lo), max(hi)) if lo else (None, None)
+
+def _span_from_stats(md: pq.FileMetaData, ts_col: str) -> list[str | None] | None:
+    """ISO [start, end] from footer stats, or None when they can't be trusted for this column."""
+    mm = _minmax_from_stats(md, ts_col)
+    if mm is None:
+        return None
+    lo, hi = mm
+    if lo is None:
+        return [None, None]
+    if ts_col == "captured_at" and all(isinstance(v, (int, float)) for v in mm):
+        ts = pd.to_datetime([lo, hi], unit="ms")
+    elif isinstance(lo, str):
+        # String min/max are lexicographic: only chronological for uniformly formatted UTC ISO
+        if not (ISO_UTC_RE.match(lo) and ISO_UTC_RE.match(hi)):
+            return None
+        ts = pd.to_datetime([lo, hi], errors="coerce", format="ISO8601")
+    else:
+        ts = pd.to_datetime([lo, hi], errors="coerce")  # timestamp-typed column
+    if ts.isna().any():
+        return None
+    return [ts[0].isoformat(), ts[1].isoformat()]
+
 def mapillary_counts_and_times(meta_parquet: Path) -> tuple[int | None, list[str | None]]:
     """
     Returns (row_count, [iso_start, iso_end]) for the given parquet.
+    Row count and (usually) the time span come from the footer alone; the timestamp column is
+    only decoded when its row-group statistics are missing or unusable.
     Falls back gracefully if file or columns are missing.
     """
     if not meta_parquet.exists():
         return None, [None, None]
     try:
-        df = pd.read_parquet(meta_parquet)
+        pf = pq.ParquetFile(meta_parquet)
+        md = pf.metadata
+        names = pf.schema_arrow.names
+        ts_col = next((c for c in ("captured_at_utc", "captured_at") if c in names), None)
+        span = _span_from_stats(md, ts_col) if ts_col else [None, None]
+        if span is not None:
+            return int(md.num_rows), span
+        col = pf.read(columns=[ts_col]).column(0).to_pandas()
     except Exception:
         return None, [None, None]
-    if "captured_at_utc" in df.columns:
-        s = pd.to_datetime(df["captured_at_utc"], errors="coerce")
-    elif "captured_at" in df.columns:
-        # Mapillary Graph 'captured_at' often ms since epoch
-        s = pd.to_datetime(df["captured_at"], errors="coerce", unit="ms")
+    if ts_col == "captured_at_utc":
+        s = pd.to_datetime(col, errors="coerce")
     else:
-        s = pd.Series(dtype="datetime64[ns]")
+        # Mapillary Graph 'captured_at' often ms since epoch
+        s = pd.to_datetime(col, errors="coerce", unit="ms")
     s = s.dropna()
     span = [s.min().isoformat(), s.max().isoformat()] if not s.empty else [None, None]
-    return int(len(df)), span
+    return int(md.num_rows), span
 
 def best_bounds_from_gpkg(gpkg_path: Path) -> tuple[list[float] | None, list[str]]:
     layers = list_layers_safely(gpkg_path)
@@ -45,12 +100,27 @@ def best_bounds_from_gpkg(gpkg_path: Path) -> tuple[list[float] | None, list[str
     for cand in ("lod22_2d", "lod13_2d", "lod12_2d"):
         if cand in layers:
             try:
-                g = gpd.read_file(gpkg_path, layer=cand, engine="fiona").to_crs("EPSG:28992")
-                return list(map(float, g.total_bounds)), layers
+                bounds = _layer_bounds_28992(gpkg_path, cand)
             except Exception:
                 continue
+            if bounds is not None:
+                return bounds, layers
     return None, layers
 
+def _layer_bounds_28992(gpkg_path: Path, layer: str) -> list[float] | None:
+    """
+    Layer extent in EPSG:28992 from the GPKG header, without decoding any geometry.
+    3D BAG layers are EPSG:28992 or the RD+NAP compound EPSG:7415 (same horizontal CRS).
+    """
+    info = pyogrio.read_info(gpkg_path, layer=layer, force_total_bounds=True)
+    bounds = info.get("total_bounds")
+    if bounds is None or not np.all(np.isfinite(bounds)):
+        return None
+    horiz = horizontal_crs(info.get("crs") or None)
+    if horiz is not None and not is_rd_new(horiz):
+        bounds = get_transformer(horiz, "EPSG:28992").transform_bounds(*bounds)
+    return list(map(float, bounds))
+
 def count_jpegs(dir_path: Path) -> int | None:
     """
     Count *.jpg files in a directory. Returns None if directory doesn't exist.
@@ -58,11 +128,36 @@ def count_jpegs(dir_path: Path) -> int | None:
     if not dir_path.exists():
         return None
     try:
-        return sum(1 for _ in dir_path.glob("*.jpg"))
+        # Name check only, like glob: images_clean/ holds symlinks we still want counted
+        with os.scandir(dir_path) as it:
+            return sum(1 for e in it if e.name.endswith(".jpg"))
     except Exception:
         return None
 
-def main():
+def list_files(dir_path: Path, prefix: str = "", suffix: str = "") -> list[str]:
+    """Sorted paths of entries named <prefix>*<suffix>; [] if the directory doesn't exist."""
+    try:
+        with os.scandir(dir_path) as it:
+            return sorted(e.path for e in it if e.name.startswith(prefix) and e.name.endswith(suffix))
+    except FileNotFoundError:
+        return []
+
+def input_signature(paths) -> str:
+    """
+    Cheap change detector over the manifest's inputs: blake2b of (path, mtime_ns, size) per path,
+    no file contents read. Directories contribute their own mtime, which changes on any entry
+    add/remove/rename — all the manifest records about them (listings and counts).
+    """
+    sig = hashlib.blake2b(digest_size=16, usedforsecurity=False)
+    for p in paths:
+        try:
+            st = os.stat(p)
+            sig.update(f"{p}|{st.st_mtime_ns}|{st.st_size}\n".encode())
+        except OSError:
+            sig.update(f"{p}|missing\n".encode())
+    return sig.hexdigest()
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--tile-id", required=True, help="e.g., 10-430-720")
 
@@ -72,7 +167,8 @@ def main():
     ap.add_argument("--mapillary-root", default=None, help="Override mapillary root (default: <data-root>/mapillary)")
     ap.add_argument("--aerial-root", default=None, help="Override aerial root (default: <data-root>/aerial)")
     ap.add_argument("--out-root", default="data/amsterdam/processed", help="Where to write <tile>/manifest.json")
-    args = ap.parse_args()
+    ap.add_argument("--force", action="store_true", help="Rebuild even if the inputs are unchanged")
+    args = ap.parse_args(argv)
 
     # Resolve roots
     if args.data_root:
@@ -96,20 +192,8 @@ def main():
     cityjson = mesh_dir / f"{tile}.city.json"
     obj_dir = mesh_dir / "obj"
 
-    lods = {}
-    for lod in ("LoD12", "LoD13", "LoD22"):
-        p = obj_dir / lod
-        if p.exists():
-            lods[lod] = sorted([str(x) for x in p.glob("*.obj")])
-
-    bounds_28992, gpkg_layers = (None, [])
-    if gpkg.exists():
-        bounds_28992, gpkg_layers = best_bounds_from_gpkg(gpkg)
-
     # --- Aerial ---
     aerial_dir = aerial_root / tile
-    aerial_tifs = sorted([str(p) for p in aerial_dir.glob("aerial_*m.tif")])
-    aerial_pngs = sorted([str(p) for p in aerial_dir.glob("aerial_*m.png")])
 
     # --- Mapillary ---
     mdir = mapillary_root / tile
@@ -120,14 +204,52 @@ def main():
 
     meta_parquet = mdir / "meta_28992.parquet"
     meta_clean_parquet = mdir / "meta_clean.parquet"
-    count_raw, span_raw = mapillary_counts_and_times(meta_parquet)
-    count_clean, span_clean = mapillary_counts_and_times(meta_clean_parquet)
 
-    # File counts in each images directory (thumbs & full-res)
-    n_images = count_jpegs(images_dir)
-    n_images_clean = count_jpegs(images_clean_dir)
-    n_images_full = count_jpegs(images_full_dir)
-    n_images_full_clean = count_jpegs(images_full_clean_dir)
+    # --- Incremental: skip all probes when no input changed since the last manifest ---
+    out_path = out_dir / "manifest.json"
+    signature = input_signature([
+        mesh_dir, gpkg, cityjson, obj_dir, *(obj_dir / lod for lod in ("LoD12", "LoD13", "LoD22")),
+        aerial_dir, mdir, images_dir, images_clean_dir, images_full_dir, images_full_clean_dir,
+        meta_parquet, meta_clean_parquet, DEFAULT_TILE_INDEX,
+    ])
+    if not args.force and out_path.exists():
+        try:
+            with open(out_path) as f:
+                previous = json.load(f).get("input_signature")
+        except (OSError, ValueError):
+            previous = None
+        if previous == signature:
+            print(f"[i] up-to-date: {out_path}")
+            return
+
+    # Every probe below is independent I/O (stat/scandir/footer reads, GIL released in C),
+    # so run them concurrently: wall time becomes the slowest probe, not the sum.
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as ex:
+        fut_bounds = ex.submit(best_bounds_from_gpkg, gpkg) if gpkg.exists() else None
+        fut_tifs = ex.submit(list_files, aerial_dir, "aerial_", "m.tif")
+        fut_pngs = ex.submit(list_files, aerial_dir, "aerial_", "m.png")
+        fut_raw = ex.submit(mapillary_counts_and_times, meta_parquet)
+        fut_clean = ex.submit(mapillary_counts_and_times, meta_clean_parquet)
+        # File counts in each images directory (thumbs & full-res)
+        fut_counts = {
+            d: ex.submit(count_jpegs, d)
+            for d in (images_dir, images_clean_dir, images_full_dir, images_full_clean_dir)
+        }
+
+        # One scandir per LoD dir, run alongside the other probes (no Path/fnmatch per entry)
+        fut_lods = {lod: ex.submit(list_files, obj_dir / lod, "", ".obj")
+                    for lod in ("LoD12", "LoD13", "LoD22") if (obj_dir / lod).exists()}
+
+    lods = {lod: fut.result() for lod, fut in fut_lods.items()}
+    bounds_28992, gpkg_layers = fut_bounds.result() if fut_bounds is not None else (None, [])
+    aerial_tifs = fut_tifs.result()
+    aerial_pngs = fut_pngs.result()
+    count_raw, span_raw = fut_raw.result()
+    count_clean, span_clean = fut_clean.result()
+    n_images = fut_counts[images_dir].result()
+    n_images_clean = fut_counts[images_clean_dir].result()
+    n_images_full = fut_counts[images_full_dir].result()
+    n_images_full_clean = fut_counts[images_full_clean_dir].result()
 
     # --- Tile polygon ---
     poly = tile_polygon(tile)
@@ -135,7 +257,8 @@ def main():
 
     manifest = {
         "tile_id": tile,
-        "created_at": datetime.utcnow().isoformat() + "Z",
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z"),
+        "input_signature": signature,
         "crs": "EPSG:28992",
         "tile_polygon_wkt": poly_wkt,
         "mesh": {
@@ -171,9 +294,8 @@ def main():
         },
     }
 
-    out_path = out_dir / "manifest.json"
-    with open(out_path, "w") as f:
-        json.dump(manifest, f, indent=2)
+    with open(out_path, "wb") as f:
+        f.write(dumps(manifest, indent=True))
     print(f"[i] Wrote {out_path}")
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+# scripts/buildings_cache.py
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely import make_valid
+from shapely.strtree import STRtree
+
+from scripts.utils_crs import is_rd_new
+
+
+TILE_MARGIN_M = 100.0  # buildings kept around the tile polygon for distance checks
+_LOADED = {}  # (gpkg, layer, bbox) -> (gpkg mtime_ns, buildings, STRtree)
+_LOADED_MAX = 4
+
+
+def tile_bbox(tile_poly, margin_m: float = TILE_MARGIN_M):
+    """Buildings read window for a tile: polygon bounds grown by margin_m."""
+    return tile_poly.buffer(margin_m).bounds
+
+
+def cache_path(gpkg_path: Path, layer: str) -> Path:
+    """Cleaned-footprint GeoParquet sidecar next to the tile GPKG."""
+    return gpkg_path.with_name(f"{gpkg_path.stem}.{layer}.buildings.parquet")
+
+
+def _bbox_mask(gdf: gpd.GeoDataFrame, bbox) -> pd.Series:
+    # Same test the GeoParquet covering-bbox filter applies: feature bounds overlap bbox
+    minx, miny, maxx, maxy = bbox
+    b = gdf.bounds
+    return (b["minx"] <= maxx) & (b["maxx"] >= minx) & (b["miny"] <= maxy) & (b["maxy"] >= miny)
+
+
+def _clean(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    # Already RD New: relabel instead of pushing every vertex through PROJ
+    crs = gdf.crs
+    if is_rd_new(crs):
+        if crs.to_epsg() != 28992:
+            gdf = gdf.set_crs("EPSG:28992", allow_override=True)
+    else:
+        gdf = gdf.to_crs("EPSG:28992")
+    # Vectorized GEOS make_valid, only over the invalid geometries (None stays None), keeps the CRS
+    geoms = gdf.geometry.to_numpy().copy()
+    bad = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+    if bad.any():
+        geoms[bad] = make_valid(geoms[bad])
+    gdf["geometry"] = gpd.GeoSeries(geoms, index=gdf.index, crs=gdf.crs)
+    # MultiPolygons stay one row: STRtree indexes them whole and nearest distance is to the closest part
+    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notnull() & gdf.geometry.is_valid].reset_index(drop=True)
+    return gdf
+
+
+def load_buildings(gpkg_path: Path, layer: str, bbox=None) -> gpd.GeoDataFrame:
+    """
+    Cleaned footprints (valid, EPSG:28992) for one GPKG layer. The first caller writes
+    them to a GeoParquet sidecar with a covering bbox column; later steps (verify, clean) read
+    that instead of the GPKG, and only the row groups overlapping `bbox`.
+    """
+    cache = cache_path(gpkg_path, layer)
+    if cache.exists() and cache.stat().st_mtime >= gpkg_path.stat().st_mtime:
+        try:
+            return gpd.read_parquet(cache, bbox=bbox)
+        except Exception as e:
+            print(f"[w] Ignoring buildings cache {cache}: {e}")
+
+    try:
+        gdf = gpd.read_file(gpkg_path, layer=layer)
+    except Exception as e:
+        print(f"[w] Failed to read layer '{layer}' via pyogrio: {e}; retrying with Fiona…")
+        gdf = gpd.read_file(gpkg_path, layer=layer, engine="fiona")
+    gdf = _clean(gdf)
+
+    # Per-process temp name: concurrent steps/tiles on a cold cache must not share one file
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=cache.parent, prefix=cache.name + ".", suffix=".tmp")
+        os.close(fd)
+        gdf.to_parquet(tmp, index=False, compression="zstd", write_covering_bbox=True)
+        os.replace(tmp, cache)
+    except Exception as e:
+        print(f"[w] Could not write buildings cache {cache}: {e}")
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+    if bbox is not None:
+        gdf = gdf[_bbox_mask(gdf, bbox)].reset_index(drop=True)
+    return gdf
+
+
+def load_buildings_and_tree(gpkg_path: Path, layer: str, bbox=None):
+    """
+    (buildings, STRtree over their geometries); the tree is rebuilt from cached geometries.
+    Kept in memory per (gpkg, layer, bbox) while the GPKG is unchanged, so steps run in the
+    same interpreter (tools/run_for_tiles: verify -> clean) share one load and one tree.
+    """
+    key = (str(gpkg_path), layer, None if bbox is None else tuple(bbox))
+    mtime = gpkg_path.stat().st_mtime_ns
+    hit = _LOADED.get(key)
+    if hit is not None and hit[0] == mtime:
+        return hit[1], hit[2]
+    gdf = load_buildings(gpkg_path, layer, bbox=bbox)
+    tree = STRtree(gdf.geometry.to_numpy())
+    if len(_LOADED) >= _LOADED_MAX:
+        _LOADED.clear()  # batch runs move on tile by tile; keep only the current tile's
+    _LOADED[key] = (mtime, gdf, tree)
+    return gdf, tree
@@ -1,17 +1,27 @@
 # scripts/download_3dbag_tile.py
 import os
 import re
+import gzip
+import shutil
+import tempfile
 import argparse
 import zipfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pyogrio
 import requests
 
+from scripts.tiles import RE_DASH_ID_IN_URL, RE2_DASH_ID_IN_URL
+
 TILE_INDEX = "data/amsterdam/mesh/tile_index.fgb"
+TILE_INDEX_CACHE = "data/amsterdam/mesh/tile_index.idx.parquet"
+INDEX_COLUMNS = ["tile_id", "obj_download", "gpkg_download", "cj_download"]
 
-# Regex to detect dash-form id in URLs and LoD from filenames
-RE_DASH_ID_IN_URL = re.compile(r"/([0-9]+-[0-9]+-[0-9]+)\.(?:zip|gpkg|city\.json)$", re.IGNORECASE)
+# Regex to detect LoD from filenames (dash-form ids in URLs: scripts.tiles.RE_DASH_ID_IN_URL)
 RE_LOD_IN_NAME = re.compile(r"LoD(\d{2})", re.IGNORECASE)  # matches LoD12, LoD13, LoD22, etc.
 
 
@@ -26,70 +36,138 @@ def _dash_id_from_row(row) -> str | None:
     return None
 
 
-def _organize_lod_subdirs(obj_root: Path) -> None:
+def load_tile_index(index_path: str = TILE_INDEX, cache_path: str = TILE_INDEX_CACHE) -> pa.Table:
+    """
+    Id/URL attributes of the tile index plus a precomputed 'dash_id' column. Built once from the
+    .fgb (no geometry) and persisted as a small parquet next to it; reused while the .fgb's mtime
+    still matches the one recorded in the parquet metadata.
     """
-    Move extracted OBJ/MTL (and any related files) into obj/LoD12, obj/LoD13, obj/LoD22 subdirs
-    based on the filename containing 'LoD12', 'LoD13', 'LoD22'. Idempotent and safe to re-run.
+    src_mtime = str(os.stat(index_path).st_mtime_ns).encode()
+    if os.path.exists(cache_path):
+        meta = pq.read_schema(cache_path).metadata or {}
+        if meta.get(b"source_mtime_ns") == src_mtime:
+            return pq.read_table(cache_path)
+
+    # Matching runs on the Arrow string buffers — no Python string objects per row
+    _, tbl = pyogrio.read_arrow(index_path, columns=INDEX_COLUMNS, read_geometry=False)
+    tbl = tbl.select(INDEX_COLUMNS).cast(pa.schema([(c, pa.string()) for c in INDEX_COLUMNS]))
+    # Same precedence as _dash_id_from_row: obj, then gpkg, then cj
+    ids = [pc.struct_field(pc.extract_regex(tbl[col], RE2_DASH_ID_IN_URL), [0])
+           for col in ("obj_download", "gpkg_download", "cj_download")]
+    tbl = tbl.append_column("dash_id", pc.coalesce(*ids))
+    tbl = tbl.replace_schema_metadata({b"source_mtime_ns": src_mtime})
+    # Per-process temp name: parallel cold-cache runs must not write into the same file
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".",
+                                   prefix=os.path.basename(cache_path) + ".", suffix=".part")
+        os.close(fd)
+        pq.write_table(tbl, tmp)
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        print(f"[w] Could not write tile index cache {cache_path}: {e}")
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+    return tbl
+
+
+def _download(sess: requests.Session, url: str, dest: Path, timeout: int, headers: dict | None = None) -> None:
     """
-    if not obj_root.exists():
-        return
+    Stream url to dest in 1 MiB chunks (no whole-file buffer in memory). Writes to a .part
+    file and renames on success, so an interrupted download is never mistaken for 'Exists'.
+    """
+    tmp = dest.with_name(dest.name + ".part")
+    with sess.get(url, stream=True, timeout=timeout, headers=headers) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # undo transport Content-Encoding, if any
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1 << 20)
+    tmp.replace(dest)
 
-    # Create target subdirs
-    lod_dirs = {lod: (obj_root / f"LoD{lod}") for lod in ("12", "13", "22")}
-    for d in lod_dirs.values():
-        d.mkdir(parents=True, exist_ok=True)
 
-    # Walk all files directly under obj_root (and nested, just in case)
-    for p in list(obj_root.rglob("*")):
-        if p.is_dir():
-            continue
-        lod_match = RE_LOD_IN_NAME.search(p.name)
-        if not lod_match:
-            continue  # skip files without LoD tag
+DEFAULT_LODS = ("12", "13", "22")
 
-        lod = lod_match.group(1)  # '12' | '13' | '22' | ...
-        target_dir = obj_root / f"LoD{lod}"
-        target_dir.mkdir(parents=True, exist_ok=True)
 
-        dest = target_dir / p.name
-        if dest.exists():
-            # Already organized; skip
-            continue
-        try:
-            p.replace(dest)  # move
-        except Exception:
-            # If moving across devices fails, fall back to copy+unlink
-            import shutil
-            shutil.copy2(p, dest)
-            p.unlink(missing_ok=True)
+def _normalize_lods(lods) -> set[str]:
+    """Accept '22' or 'LoD22' (any case) and return the bare two-digit codes."""
+    return {re.sub(r"(?i)^lod", "", str(l)) for l in lods}
 
 
-def main():
+def _extract_obj_zip(zip_path: Path, obj_root: Path, workers: int = 0,
+                     lods=DEFAULT_LODS) -> tuple[int, int]:
+    """
+    Extract OBJ/MTL (and any related files) straight into obj/LoD12, obj/LoD13, obj/LoD22 subdirs
+    based on the member name containing 'LoD12', 'LoD13', 'LoD22' — one pass, no extract-then-move.
+    Only members whose LoD is in `lods` are inflated; untagged members are skipped. Idempotent:
+    members already on disk with the same size are left alone. Inflate releases the GIL, so
+    members are split across `workers` threads (0 = CPU count). Returns (written, skipped).
+    """
+    wanted = _normalize_lods(lods)
+    for lod in wanted:
+        (obj_root / f"LoD{lod}").mkdir(parents=True, exist_ok=True)
+
+    plan: dict[Path, zipfile.ZipInfo] = {}
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            name = Path(info.filename).name
+            lod_match = RE_LOD_IN_NAME.search(name)
+            if not lod_match or lod_match.group(1) not in wanted:
+                continue  # untagged, or an LoD we were not asked for
+            target_dir = obj_root / f"LoD{lod_match.group(1)}"  # '12' | '13' | '22'
+            plan[target_dir / name] = info  # one writer per destination; last member wins
+
+    todo = [(info, dest) for dest, info in plan.items()
+            if not (dest.exists() and dest.stat().st_size == info.file_size)]
+    skipped = len(plan) - len(todo)
+
+    def _worker(chunk) -> int:
+        # Own handle per thread: a shared ZipFile's seek position is not thread-safe
+        with zipfile.ZipFile(zip_path, "r") as zf:
+            for info, dest in chunk:
+                with zf.open(info) as src, open(dest, "wb") as dst:
+                    shutil.copyfileobj(src, dst, length=1 << 20)
+        return len(chunk)
+
+    n = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        written = sum(ex.map(_worker, [todo[i::n] for i in range(n)]))
+    return written, skipped
+
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--tile-id", required=True, help="Slash or dash form, e.g. 10/430/720 or 10-430-720")
     ap.add_argument("--outdir-base", default="data/amsterdam/mesh", help="Base directory to place the tile folder")
     ap.add_argument("--skip-obj", action="store_true", help="Skip downloading/extracting OBJ zip")
     ap.add_argument("--skip-gpkg", action="store_true", help="Skip downloading GPKG")
     ap.add_argument("--skip-cityjson", action="store_true", help="Skip downloading CityJSON")
-    args = ap.parse_args()
+    ap.add_argument("--extract-workers", type=int, default=0,
+                    help="Threads for OBJ zip extraction (0 = CPU count)")
+    ap.add_argument("--lods", nargs="+", default=list(DEFAULT_LODS),
+                    help="LoDs to extract from the OBJ zip, e.g. --lods 22 or --lods LoD12 LoD22")
+    args = ap.parse_args(argv)
 
-    g = gpd.read_file(TILE_INDEX)
+    tbl = load_tile_index()
 
     dash = args.tile_id.replace("/", "-")
-    # Prefer matching by dash id embedded in download columns
-    hit = g[
-        g["obj_download"].astype(str).str.contains(dash, na=False) |
-        g["gpkg_download"].astype(str).str.contains(dash, na=False) |
-        g["cj_download"].astype(str).str.contains(dash, na=False)
-    ]
-    if hit.empty:
-        # Fallback: exact match on slash-form tile_id
-        hit = g[g["tile_id"].astype(str) == args.tile_id]
-    if hit.empty:
+    # Exact hit on the precomputed dash id, then on the slash-form tile_id
+    hit = tbl.filter(pc.equal(tbl["dash_id"], dash))
+    if hit.num_rows == 0:
+        hit = tbl.filter(pc.equal(tbl["tile_id"], args.tile_id))
+    if hit.num_rows == 0:
+        # Fallback: dash id embedded anywhere in the download columns
+        mask = None
+        for col in ("obj_download", "gpkg_download", "cj_download"):
+            m = pc.match_substring(tbl[col], dash)
+            mask = m if mask is None else pc.or_kleene(mask, m)
+        hit = tbl.filter(mask)
+    if hit.num_rows == 0:
         raise SystemExit(f"Tile {args.tile_id} not found in {TILE_INDEX}")
 
-    row = hit.iloc[0]
-    dash_id = _dash_id_from_row(row) or dash
+    row = hit.slice(0, 1).to_pylist()[0]
+    dash_id = row.get("dash_id") or _dash_id_from_row(row) or dash
 
     out_dir = Path(args.outdir_base) / dash_id
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -108,58 +186,53 @@ def main():
         "objzip": row.get("obj_download"),
     }
 
-    # Download CityJSON
-    if not args.skip_cityjson and isinstance(urls["cityjson"], str) and urls["cityjson"]:
-        if cityjson_path.exists():
-            print(f"[i] Exists: {cityjson_path.name}")
-        else:
-            print(f"[i] Downloading CityJSON → {cityjson_path}")
-            r = requests.get(urls["cityjson"], timeout=180)
-            r.raise_for_status()
-            cityjson_path.write_bytes(r.content)
-
-    # Download GPKG
-    if not args.skip_gpkg and isinstance(urls["gpkg"], str) and urls["gpkg"]:
-        if gpkg_path.exists():
-            print(f"[i] Exists: {gpkg_path.name}")
-        else:
-            print(f"[i] Downloading GPKG → {gpkg_path}")
-            r = requests.get(urls["gpkg"], timeout=300)
-            r.raise_for_status()
-            gpkg_path.write_bytes(r.content)
-
-            # Auto-decompress if the server sent a gzipped gpkg
-            import gzip, shutil
-            with open(gpkg_path, "rb") as f:
-                head = f.read(2)
-            is_gzip = head == b"\x1f\x8b"
-            if is_gzip:
-                tmp = gpkg_path.with_suffix(".gpkg.gz")
-                gpkg_path.rename(tmp)
-                with gzip.open(tmp, "rb") as fin, open(gpkg_path, "wb") as fout:
-                    shutil.copyfileobj(fin, fout)
-                tmp.unlink()
-                print(f"[i] Decompressed gzipped GeoPackage → {gpkg_path.name}")
-
-    # Download & extract OBJ ZIP
+    # Queue the missing assets, then download them concurrently over one pooled session;
+    # only the gzip check and OBJ extraction below depend on a download having finished.
+    assets = [
+        ("CityJSON", not args.skip_cityjson, urls["cityjson"], cityjson_path, 180, None),
+        # identity: keep any gzip on the file itself intact for the check below
+        ("GPKG", not args.skip_gpkg, urls["gpkg"], gpkg_path, 300, {"Accept-Encoding": "identity"}),
+        ("OBJ ZIP", not args.skip_obj, urls["objzip"], obj_zip_path, 600, None),
+    ]
+    jobs = []
+    for label, enabled, url, dest, timeout, headers in assets:
+        if not enabled or not isinstance(url, str) or not url:
+            continue
+        if dest.exists():
+            print(f"[i] Exists: {dest.name}")
+            continue
+        print(f"[i] Downloading {label} → {dest}")
+        jobs.append((url, dest, timeout, headers))
+
+    if jobs:
+        sess = requests.Session()
+        with ThreadPoolExecutor(max_workers=len(jobs)) as ex:
+            futs = [ex.submit(_download, sess, url, dest, timeout, headers) for url, dest, timeout, headers in jobs]
+            for fut in futs:
+                fut.result()  # re-raise the first HTTP/IO error
+
+    # Auto-decompress if the server sent a gzipped gpkg
+    if any(dest == gpkg_path for _, dest, _, _ in jobs):
+        with open(gpkg_path, "rb") as f:
+            head = f.read(2)
+        is_gzip = head == b"\x1f\x8b"
+        if is_gzip:
+            tmp = gpkg_path.with_suffix(".gpkg.gz")
+            gpkg_path.rename(tmp)
+            with gzip.open(tmp, "rb") as fin, open(gpkg_path, "wb") as fout:
+                shutil.copyfileobj(fin, fout)
+            tmp.unlink()
+            print(f"[i] Decompressed gzipped GeoPackage → {gpkg_path.name}")
+
+    # Extract & organize OBJ ZIP
     if not args.skip_obj and isinstance(urls["objzip"], str) and urls["objzip"]:
-        if obj_zip_path.exists():
-            print(f"[i] Exists: {obj_zip_path.name}")
-        else:
-            print(f"[i] Downloading OBJ ZIP → {obj_zip_path}")
-            r = requests.get(urls["objzip"], timeout=600)
-            r.raise_for_status()
-            obj_zip_path.write_bytes(r.content)
-
-        # Extract (idempotent)
+        # Extract into LoD subdirs (idempotent)
         print(f"[i] Extracting to {obj_dir} …")
-        with zipfile.ZipFile(obj_zip_path, "r") as zf:
-            # Extract all; if re-running, ZipFile will overwrite into same paths
-            zf.extractall(obj_dir)
-
-        # Organize into LoD subdirs
-        _organize_lod_subdirs(obj_dir)
-        print(f"[✓] Organized OBJ files into {obj_dir}/LoD12, LoD13, LoD22")
+        written, skipped = _extract_obj_zip(obj_zip_path, obj_dir, workers=args.extract_workers,
+                                            lods=args.lods)
+        subdirs = ", ".join(f"LoD{l}" for l in sorted(_normalize_lods(args.lods)))
+        print(f"[✓] Extracted OBJ files into {obj_dir}/{subdirs} "
+              f"(written={written}, already present={skipped})")
 
     print(f"[✓] Tile ready at {out_dir.resolve()}")
 
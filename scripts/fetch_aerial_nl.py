@@ -1,6 +1,8 @@
 # scripts/fetch_aerial_nl.py
 import argparse
 import math
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
@@ -8,18 +10,54 @@ import geopandas as gpd
 import imageio.v2 as iio
 import numpy as np
 import rasterio
+from rasterio import windows
+from rasterio.features import geometry_mask
 from rasterio.transform import from_bounds
+from rasterio.windows import Window
 import requests
-import rioxarray  # noqa: F401  (registers .rio)
-import xarray as xr
-from shapely.geometry import mapping
+from PIL import Image
+from shapely.geometry import box, mapping
 from scripts.tiles import tile_polygon
 
+try:  # optional: PyTurboJPEG + libjpeg-turbo (pip install PyTurboJPEG)
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _TURBOJPEG = TurboJPEG()
+except Exception:
+    _TURBOJPEG = None
+
+try:  # optional: on-disk HTTP cache (pip install requests-cache)
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
 DEFAULT_WMS = "https://service.pdok.nl/hwh/luchtfotorgb/wms/v1_0"
+DEFAULT_CACHE = "data/cache/wms"
+CACHE_EXPIRE_S = 30 * 86400
+_ERROR_CONTENT_TYPES = ("text/xml", "application/xml", "application/vnd.ogc.se_xml", "text/html")
+# Fill for pixels outside the tile polygon (rioxarray's uint8 clip default, kept for continuity)
+CLIP_NODATA = 255
 # Common PDOK layers:
 #  - Actueel_ortho25  (25 cm GSD)
 #  - Actueel_orthoHR  (8–10 cm GSD in many areas)
 
+def make_session(cache_dir: str | None = DEFAULT_CACHE) -> requests.Session:
+    """
+    HTTP session for WMS requests. With requests-cache (optional) installed and cache_dir set, GetMap
+    responses are kept in a SQLite cache keyed on URL + normalized params, so re-running the
+    same tile/layer/GSD is served from disk; expired entries are revalidated via ETag /
+    Last-Modified when the server provides them. XML/HTML error payloads are never cached.
+    """
+    if cache_dir and requests_cache is not None:
+        Path(cache_dir).parent.mkdir(parents=True, exist_ok=True)
+        return requests_cache.CachedSession(
+            cache_dir,
+            backend="sqlite",
+            expire_after=CACHE_EXPIRE_S,
+            allowable_methods=("GET",),
+            filter_fn=lambda r: not r.headers.get("Content-Type", "").startswith(_ERROR_CONTENT_TYPES),
+        )
+    return requests.Session()
+
 def fetch_wms_jpeg(
     wms_url: str,
     layer: str,
@@ -28,6 +66,7 @@ def fetch_wms_jpeg(
     height: int,
     fmt: str = "image/jpeg",
     timeout: int = 120,
+    session: requests.Session | None = None,
 ) -> bytes:
     """Request a WMS 1.3.0 GetMap image for EPSG:28992."""
     minx, miny, maxx, maxy = bbox_28992
@@ -44,23 +83,102 @@ def fetch_wms_jpeg(
         "width": str(width),
         "height": str(height),
     }
-    r = requests.get(wms_url, params=params, timeout=timeout)
+    r = (session or requests).get(wms_url, params=params, timeout=timeout)
     r.raise_for_status()
     # crude guard against XML error payloads
-    if r.headers.get("Content-Type", "").startswith(("text/xml", "application/xml", "text/html")):
+    if r.headers.get("Content-Type", "").startswith(_ERROR_CONTENT_TYPES):
         raise RuntimeError(f"WMS returned XML/HTML error: {r.text[:400]}")
     return r.content
 
-def main():
+def decode_rgb(data: bytes) -> np.ndarray:
+    """
+    Decode image bytes to a contiguous (H, W, 3) uint8 RGB array. Uses libjpeg-turbo's SIMD
+    decoder when PyTurboJPEG is installed, else Pillow (which also converts grayscale/alpha).
+    """
+    if _TURBOJPEG is not None:
+        try:
+            return _TURBOJPEG.decode(data, pixel_format=TJPF_RGB)
+        except Exception:
+            pass  # not a JPEG (e.g. an error PNG) — let Pillow handle it
+    with Image.open(BytesIO(data)) as im:
+        return np.asarray(im.convert("RGB"))
+
+def fetch_wms_mosaic(
+    wms_url: str,
+    layer: str,
+    bbox_28992: tuple[float, float, float, float],
+    width: int,
+    height: int,
+    tile_px: int = 2048,
+    workers: int = 8,
+    session: requests.Session | None = None,
+) -> np.ndarray:
+    """
+    Fetch a width x height RGB raster as a grid of <= tile_px GetMap sub-requests in parallel
+    and paste them into one (H, W, 3) array. Sub-bboxes follow the full raster's pixel grid,
+    so the mosaic georeferences exactly like a single request would.
+    """
+    minx, miny, maxx, maxy = bbox_28992
+    px = (maxx - minx) / width
+    py = (maxy - miny) / height
+    out = np.empty((height, width, 3), dtype=np.uint8)
+    tiles = [(r0, c0, min(tile_px, height - r0), min(tile_px, width - c0))
+             for r0 in range(0, height, tile_px)
+             for c0 in range(0, width, tile_px)]
+
+    def fetch_paste(t) -> None:
+        r0, c0, th, tw = t
+        sub = (minx + c0 * px, maxy - (r0 + th) * py, minx + (c0 + tw) * px, maxy - r0 * py)
+        arr = decode_rgb(fetch_wms_jpeg(wms_url, layer, sub, tw, th, fmt="image/jpeg", session=session))
+        if arr.shape[:2] != (th, tw):
+            raise RuntimeError(f"WMS returned {arr.shape[1]}x{arr.shape[0]}px for a {tw}x{th}px request")
+        out[r0:r0 + th, c0:c0 + tw] = arr
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tiles)))) as ex:
+        list(ex.map(fetch_paste, tiles))  # list() re-raises the first failed sub-request
+    return out
+
+def write_geotiff(path: Path, img: np.ndarray, transform, nodata: int | None = None) -> None:
+    """
+    Write an (H, W, 3) uint8 array as a deflate-compressed EPSG:28992 GeoTIFF in a single
+    all-bands write; tiled + pixel-interleaved so GDAL can compress blocks on all cores.
+    """
+    profile = {
+        "driver": "GTiff",
+        "height": img.shape[0],
+        "width": img.shape[1],
+        "count": 3,
+        "dtype": rasterio.uint8,
+        "crs": "EPSG:28992",
+        "transform": transform,
+        "compress": "deflate",
+        "interleave": "pixel",
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "num_threads": "ALL_CPUS",
+    }
+    if nodata is not None:
+        profile["nodata"] = nodata
+    chw = np.ascontiguousarray(np.moveaxis(img, -1, 0))  # (3, H, W)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(chw)
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--tile-id", required=True, help="e.g., 10-430-720")
     ap.add_argument("--outdir", default="data/amsterdam/aerial", help="base output dir")
     ap.add_argument("--wms-url", default=DEFAULT_WMS, help="PDOK WMS endpoint")
     ap.add_argument("--layer", default="Actueel_ortho25", help="PDOK layer: Actueel_ortho25 or Actueel_orthoHR")
     ap.add_argument("--gsd", type=float, default=0.25, help="target ground sampling distance in meters/pixel")
-    ap.add_argument("--max-size", type=int, default=8000, help="max pixels for width/height to avoid huge requests")
+    ap.add_argument("--max-size", type=int, default=4096, help="rasters above max-size² pixels are fetched as a grid of sub-requests")
+    ap.add_argument("--tile-px", type=int, default=2048, help="sub-request size in pixels for large rasters")
+    ap.add_argument("--workers", type=int, default=8, help="concurrent WMS sub-requests")
+    ap.add_argument("--cache-dir", default=None,
+                    help=f"requests-cache SQLite path for WMS responses (default: {DEFAULT_CACHE}, if requests-cache is installed)")
+    ap.add_argument("--no-cache", action="store_true", help="always hit the WMS (skip the on-disk cache)")
     ap.add_argument("--buffer-m", type=float, default=0.0, help="optional buffer in meters around tile bbox")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     tile = args.tile_id
     outdir = Path(args.outdir) / tile
@@ -79,24 +197,26 @@ def main():
     # 2) Compute output raster size from desired GSD
     width  = int(math.ceil((maxx - minx) / args.gsd))
     height = int(math.ceil((maxy - miny) / args.gsd))
-    # Clamp to avoid excessive server load; adjust effective GSD accordingly
-    if width > args.max_size or height > args.max_size:
-        scale = max(width / args.max_size, height / args.max_size)
-        width  = int(width / scale)
-        height = int(height / scale)
-        # We keep bbox; this effectively increases pixel size (coarser GSD).
-
-    print(f"[i] Requesting WMS {args.layer} at ~{args.gsd} m/px -> {width}x{height}px")
 
-    # 3) Fetch WMS image (JPEG)
-    jpeg_bytes = fetch_wms_jpeg(args.wms_url, args.layer, bbox, width, height, fmt="image/jpeg")
+    # requests-cache is optional: only warn when a cache was asked for explicitly
+    if args.cache_dir and not args.no_cache and requests_cache is None:
+        print("[w] requests-cache not installed; WMS responses will not be cached")
+    session = make_session(None if args.no_cache else (args.cache_dir or DEFAULT_CACHE))
 
-    # 4) Decode to array; force RGB
-    img = iio.imread(BytesIO(jpeg_bytes))
-    if img.ndim == 2:  # grayscale
-        img = np.stack([img, img, img], axis=-1)
-    if img.shape[2] == 4:  # drop alpha
-        img = img[:, :, :3]
+    # 3) Fetch WMS image at the full requested GSD: one GetMap for small rasters, otherwise a
+    #    grid of concurrent sub-requests (no resolution downgrade for large tiles)
+    if width * height <= args.max_size ** 2:
+        print(f"[i] Requesting WMS {args.layer} at ~{args.gsd} m/px -> {width}x{height}px")
+        jpeg_bytes = fetch_wms_jpeg(args.wms_url, args.layer, bbox, width, height, fmt="image/jpeg",
+                                    session=session)
+        # 4) Decode to (H, W, 3) uint8 RGB
+        img = decode_rgb(jpeg_bytes)
+    else:
+        n = math.ceil(width / args.tile_px) * math.ceil(height / args.tile_px)
+        print(f"[i] Requesting WMS {args.layer} at ~{args.gsd} m/px -> {width}x{height}px "
+              f"as {n} tiles of <= {args.tile_px}px")
+        img = fetch_wms_mosaic(args.wms_url, args.layer, bbox, width, height,
+                               tile_px=args.tile_px, workers=args.workers, session=session)
 
     # 5) Write GeoTIFF (EPSG:28992), then clip to exact tile polygon
     geotiff_path = outdir / f"aerial_{args.layer}_{args.gsd:.2f}m_raw.tif"
@@ -104,30 +224,34 @@ def main():
     png_path     = outdir / f"aerial_{args.layer}_{args.gsd:.2f}m.png"
 
     transform = from_bounds(minx, miny, maxx, maxy, img.shape[1], img.shape[0])
-    profile = {
-        "driver": "GTiff",
-        "height": img.shape[0],
-        "width": img.shape[1],
-        "count": 3,
-        "dtype": rasterio.uint8,
-        "crs": "EPSG:28992",
-        "transform": transform,
-        "compress": "deflate",
-    }
-    with rasterio.open(geotiff_path, "w", **profile) as dst:
-        for b in range(3):
-            dst.write(img[:, :, b], b + 1)
+    write_geotiff(geotiff_path, img, transform)
     print(f"[i] Wrote {geotiff_path}")
 
-    # Clip to exact polygon
-    da = rioxarray.open_rasterio(geotiff_path)  # (band, y, x)
-    clipped = da.rio.clip([mapping(poly)], crs="EPSG:28992")
-    clipped.rio.to_raster(clipped_path, compress="deflate")
+    # Clip to exact polygon in memory (no re-read of the GeoTIFF): crop to the polygon's
+    # pixel window, then fill pixels outside the polygon with nodata. Most tiles are axis-aligned
+    # rectangles (the polygon fills its envelope; robust to vertex order, unlike equals_exact),
+    # for which the mask is all-inside and is skipped; without a buffer the window is then the
+    # whole raster, so the raw GeoTIFF is copied instead of re-encoded.
+    is_rect = poly.area >= box(*poly.bounds).area * (1 - 1e-9)
+    full = Window(0, 0, img.shape[1], img.shape[0])
+    win = windows.from_bounds(*poly.bounds, transform=transform).round_offsets().round_lengths().intersection(full)
+    if is_rect and win.flatten() == full.flatten():
+        clipped = img
+        shutil.copyfile(geotiff_path, clipped_path)
+        with rasterio.open(clipped_path, "r+") as dst:
+            dst.nodata = CLIP_NODATA  # same tags as the masked path
+    else:
+        clip_transform = windows.transform(win, transform)
+        clipped = img[win.toslices()]
+        if not is_rect:
+            clipped = clipped.copy()
+            outside = geometry_mask([mapping(poly)], out_shape=clipped.shape[:2], transform=clip_transform)
+            clipped[outside] = CLIP_NODATA
+        write_geotiff(clipped_path, clipped, clip_transform, nodata=CLIP_NODATA)
     print(f"[i] Wrote {clipped_path}")
 
-    # Save PNG quicklook (channel-last)
-    png_arr = np.moveaxis(clipped.values, 0, -1)  # (H,W,3)
-    iio.imwrite(png_path, png_arr.astype(np.uint8))
+    # Save PNG quicklook (already channel-last uint8)
+    iio.imwrite(png_path, clipped)
     print(f"[i] Wrote {png_path}")
 
     print("[✓] Aerial orthophoto ready.")
@@ -1,18 +1,38 @@
 # scripts/fetch_mapillary.py
 import os
+import re
 import sys
 import json
+import mmap
+import queue
+import hashlib
+import shutil
 import time
 import random
 import argparse
+import tempfile
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Iterable, Optional, Tuple, List
 
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import geopandas as gpd
 
 from scripts.tiles import tile_polygon, tile_bbox_4326
+from scripts.utils_json import dumps, loads
+
+
+try:  # optional: HTTP/2 client for the Graph API (pip install "httpx[http2]")
+    import httpx
+except ImportError:
+    httpx = None
+
+# Status errors raised by raise_for_status() on either client
+HTTP_STATUS_ERRORS = (requests.HTTPError,) + ((httpx.HTTPStatusError,) if httpx is not None else ())
 
 # ───────────────────────────── Config ─────────────────────────────
 
@@ -30,6 +50,10 @@ FIELDS = ",".join([
     "thumb_2048_url",
 ])
 API_URL = "https://graph.mapillary.com/images"
+DOWNLOAD_WORKERS = 16
+# Top-level string "id" member, as append_jsonl writes it (json or orjson spacing)
+RE_ID_MEMBER = re.compile(rb'"id"\s*:\s*"([^"]+)"')
+RE_NONBLANK_LINE = re.compile(rb"\S[^\n]*")  # exactly one match per non-blank line
 
 
 # ───────────────────────────── Utils ─────────────────────────────
@@ -46,17 +70,34 @@ def ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
-def read_existing_ids(meta_path: Path) -> set:
-    if not meta_path.exists():
+def read_existing_ids(meta_path: Path, start: int = 0) -> set:
+    """
+    Ids in meta.jsonl from byte offset `start` (a line boundary) on. Fast path: regex passes
+    over the memory-mapped file, pulling only the "id" values — no per-line str objects, decode
+    or JSON parse, and the file is paged in by the OS rather than copied. If the id count
+    doesn't equal the non-blank line count (non-string ids, foreign records), falls back to
+    parsing every line.
+    """
+    if not meta_path.exists() or meta_path.stat().st_size <= start:
         return set()
+    with open(meta_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        n_lines = sum(1 for _ in RE_NONBLANK_LINE.finditer(mm, start))
+        found = [m.group(1) for m in RE_ID_MEMBER.finditer(mm, start)]
+    if len(found) == n_lines:
+        return {v for v in (b.decode("utf-8", "replace").strip() for b in found) if v}
+    return _read_existing_ids_parsed(meta_path, start)
+
+
+def _read_existing_ids_parsed(meta_path: Path, start: int = 0) -> set:
     ids = set()
-    with open(meta_path, "r") as f:
+    with open(meta_path, "rb") as f:
+        f.seek(start)
         for line in f:
             line = line.strip()
             if not line:
                 continue
             try:
-                j = json.loads(line)
+                j = loads(line)
                 iid = str(j.get("id", "")).strip()
                 if iid:
                     ids.add(iid)
@@ -65,24 +106,178 @@ def read_existing_ids(meta_path: Path) -> set:
     return ids
 
 
-def append_jsonl(meta_path: Path, recs: Iterable[dict]) -> int:
-    n = 0
-    with open(meta_path, "a") as f:
-        for r in recs:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-            n += 1
-    return n
+def id_key(iid: str):
+    """
+    Compact dedupe key. Mapillary image ids are decimal strings, so they are stored as the
+    exact int (a small int object per id instead of a str; collision-free, unlike a hash).
+    Anything else (leading zeros, non-digits) stays a str, so distinct ids never merge.
+    """
+    if iid.isascii() and iid.isdigit() and iid[0] != "0":
+        return int(iid)
+    return iid
+
+
+# ─────────────── Persistent id index (meta.jsonl.ids) ───────────────
+# Header line {"covered": <bytes of meta.jsonl indexed>, "tail": <digest of the 4 KiB before>},
+# then one id per line. Startup loads it and only scans what was appended past `covered`;
+# a rewritten/truncated meta.jsonl fails the tail check and is rescanned in full.
+
+def _ids_index_path(meta_path: Path) -> Path:
+    return meta_path.with_name(meta_path.name + ".ids")
+
+
+def _tail_digest(meta_path: Path, end: int) -> str:
+    with open(meta_path, "rb") as f:
+        f.seek(max(0, end - 4096))
+        return hashlib.blake2b(f.read(min(end, 4096)), digest_size=16).hexdigest()
+
+
+def load_seen_ids(meta_path: Path) -> set:
+    """All ids in meta.jsonl: the persisted index plus a scan of bytes appended since."""
+    if not meta_path.exists():
+        return set()
+    size = meta_path.stat().st_size
+    ids, start = set(), 0
+    idx_path = _ids_index_path(meta_path)
+    if idx_path.exists():
+        try:
+            with open(idx_path, "rb") as f:
+                header = json.loads(f.readline())
+                covered = int(header["covered"])
+                if covered <= size and header["tail"] == _tail_digest(meta_path, covered):
+                    ids = {line.strip().decode("utf-8") for line in f if line.strip()}
+                    start = covered
+        except (OSError, ValueError, KeyError, TypeError):
+            ids, start = set(), 0
+    return ids | read_existing_ids(meta_path, start)
+
+
+def save_seen_ids(meta_path: Path, ids: set) -> None:
+    """Persist `ids` (which must be exactly the ids in meta.jsonl right now) as the index."""
+    if not meta_path.exists():
+        return
+    size = meta_path.stat().st_size
+    header = json.dumps({"covered": size, "tail": _tail_digest(meta_path, size)})
+    idx_path = _ids_index_path(meta_path)
+    fd, tmp = tempfile.mkstemp(dir=idx_path.parent, prefix=idx_path.name + ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(header + "\n")
+            f.writelines(f"{i}\n" for i in ids)
+        os.replace(tmp, idx_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def encode_record(rec: dict) -> bytes:
+    """One meta.jsonl line (without newline) as UTF-8 JSON bytes."""
+    return dumps(rec)
+
+
+def append_lines(meta_path: Path, lines: List[bytes], fsync: bool = True) -> int:
+    """
+    Group commit: join pre-encoded lines into one buffer, then a single write (+ fsync, so a
+    batch survives a crash) instead of one write call per record.
+    """
+    if not lines:
+        return 0
+    with open(meta_path, "ab", buffering=0) as f:
+        f.write(b"\n".join(lines) + b"\n")
+        if fsync:
+            os.fsync(f.fileno())
+    return len(lines)
+
+
+def append_jsonl(meta_path: Path, recs: Iterable[dict], fsync: bool = True) -> int:
+    return append_lines(meta_path, [encode_record(r) for r in recs], fsync)
+
+
+class JsonlWriter:
+    """
+    Single background writer for meta.jsonl. Producers put() already-encoded lines from any
+    thread (e.g. right after a record's downloads finish); the writer drains the queue in
+    batches of up to `batch` lines and appends each batch with append_lines (group commit).
+    """
+
+    _STOP = object()
+
+    def __init__(self, meta_path: Path, batch: int = 256, fsync: bool = True):
+        self.meta_path = meta_path
+        self.batch = batch
+        self.fsync = fsync
+        self.written = 0
+        self._error: Optional[BaseException] = None
+        self._q: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="meta-jsonl-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, line: bytes) -> None:
+        self._q.put(line)
+
+    def _run(self) -> None:
+        done = False
+        while not done:
+            lines = [self._q.get()]
+            while len(lines) < self.batch:
+                try:
+                    lines.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            done = any(l is self._STOP for l in lines)
+            lines = [l for l in lines if l is not self._STOP]
+            try:
+                self.written += append_lines(self.meta_path, lines, self.fsync)
+            except BaseException as e:  # surfaced by close()
+                self._error = e
+                return
+
+    def close(self) -> int:
+        """Flush everything queued so far and stop; returns the number of lines written."""
+        self._q.put(self._STOP)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.written
+
+
+def make_download_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """
+    Shared session for image downloads: keep-alive connections to the image CDN hosts are
+    reused across records and threads (one pool slot per download worker) instead of a new
+    TCP+TLS handshake per requests.get().
+    """
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
 
 
-def download_file(url: Optional[str], out_path: Path, timeout: int = 60) -> bool:
+def download_file(url: Optional[str], out_path: Path, timeout: int = 60,
+                  session: Optional[requests.Session] = None) -> bool:
+    """
+    Stream url to out_path in 64 KiB chunks (no whole image held in memory, which keeps RSS flat
+    with many concurrent downloads). Writes a .part file and renames on success, so a failed
+    download never leaves a truncated JPEG that later runs would treat as present.
+    """
     if not url:
         return False
+    tmp = out_path.with_name(out_path.name + ".part")
     try:
-        r = requests.get(url, timeout=timeout)
-        r.raise_for_status()
-        out_path.write_bytes(r.content)
+        with (session or requests).get(url, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True  # undo transport Content-Encoding, if any
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(r.raw, f, length=64 * 1024)
+        tmp.replace(out_path)
         return True
     except Exception:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
         return False
 
 
@@ -106,7 +301,13 @@ def bbox_with_margin_4326(tile_id: str, margin_m: float = 0.0) -> Tuple[float, f
     """
     Build a WGS84 bbox for the tile. If margin_m>0, buffer the tile polygon in EPSG:28992
     by that many meters before converting to WGS84 and taking the bounds.
+    Memoized per (dash-form tile id, margin); slash- and dash-form ids share one entry.
     """
+    return _bbox_with_margin_4326(str(tile_id).replace("/", "-"), float(margin_m))
+
+
+@lru_cache(maxsize=1024)
+def _bbox_with_margin_4326(tile_id: str, margin_m: float) -> Tuple[float, float, float, float]:
     if margin_m <= 1e-6:
         return tile_bbox_4326(tile_id)
     poly_28992 = tile_polygon(tile_id)
@@ -132,28 +333,120 @@ def subdivide_bbox(minlon: float, minlat: float, maxlon: float, maxlat: float, n
     return cells
 
 
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every API caller (all cells). The rate adapts AIMD-style:
+    halved on HTTP 429 (and paused for Retry-After when given), raised 10% after `grow_after`
+    consecutive successes up to `max_rate`.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0, max_rate: Optional[float] = None,
+                 min_rate: float = 0.1, grow_after: int = 10):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_rate = max_rate or rate * 4
+        self.min_rate = min_rate
+        self.grow_after = grow_after
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._ok_streak = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until one request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._ok_streak += 1
+            if self._ok_streak >= self.grow_after:
+                self.rate = min(self.max_rate, self.rate * 1.1)
+                self._ok_streak = 0
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.5)
+            self._ok_streak = 0
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+
+def _retry_after_s(resp) -> Optional[float]:
+    """Retry-After in seconds (numeric form only; HTTP-date values are ignored)."""
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After")))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def make_api_session(token: str, http2: bool = False, pool_size: int = 32):
+    """
+    One pooled, authenticated client shared by all cells (token in a header, not the URL).
+    With http2=True and httpx[http2] installed, concurrent page requests are multiplexed over a
+    single HTTP/2 connection; otherwise a requests.Session whose pool holds `pool_size`
+    keep-alive connections, so concurrent cells reuse sockets instead of reconnecting.
+    """
+    headers = {"Authorization": f"OAuth {token}"}
+    if http2:
+        if httpx is None:
+            print("[w] httpx not installed; using HTTP/1.1 (pip install \"httpx[http2]\")")
+        else:
+            try:
+                return httpx.Client(
+                    http2=True, headers=headers, timeout=60.0,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size // 2),
+                )
+            except ImportError:  # httpx without the h2 extra
+                print("[w] h2 not installed; using HTTP/1.1 (pip install \"httpx[http2]\")")
+    sess = requests.Session()
+    sess.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    sess.mount("https://", adapter)
+    return sess
+
+
 def page_iter(
     initial_url: str,
     sleep_s: float = 0.35,
-    session: Optional[requests.Session] = None,
+    session=None,
     retries: int = 3,
     backoff_base: float = 1.0,
+    bucket: Optional[TokenBucket] = None,
+    stop: Optional[threading.Event] = None,
 ) -> Iterable[dict]:
     """
     Iterate results for one API URL, following paging.next if provided.
     Some bbox queries do not provide paging.next at all (hard ~200 cap).
-    Retries on transient/timeout HTTP errors with exponential backoff + jitter.
+    Every request first takes a token from `bucket` (default: one request per sleep_s);
+    no further page is requested once `stop` is set.
+    HTTP 429 slows the bucket down and honors Retry-After; other transient/timeout HTTP
+    errors are retried with exponential backoff + jitter.
     """
     url = initial_url
     sess = session or requests.Session()
-    while url:
+    bucket = bucket or TokenBucket(1.0 / max(sleep_s, 1e-3))
+    while url and not (stop is not None and stop.is_set()):
         attempt = 0
         while True:
+            bucket.acquire()
             try:
                 r = sess.get(url, timeout=60)
                 r.raise_for_status()
+                bucket.on_success()
                 break
-            except requests.HTTPError as e:
+            except HTTP_STATUS_ERRORS as e:
                 status = getattr(e.response, "status_code", None)
                 msg = ""
                 try:
@@ -162,8 +455,13 @@ def page_iter(
                     pass
                 if attempt < retries and (status in (400, 408, 429, 500, 502, 503, 504)):
                     wait = backoff_base * (2 ** attempt) + random.uniform(0, 0.5)
+                    if status == 429:
+                        # Shared pause: every cell backs off, not just this one
+                        wait = _retry_after_s(e.response) or wait
+                        bucket.on_throttled(wait)
                     print(f"[warn] HTTP {status} on page; retrying in {wait:.1f}s. {msg}")
-                    time.sleep(wait)
+                    if status != 429:
+                        time.sleep(wait)
                     attempt += 1
                     continue
                 raise
@@ -175,12 +473,11 @@ def page_iter(
         if not next_url or not data:
             break
         url = next_url
-        time.sleep(sleep_s)
 
 
 # ───────────────────────────── Core ─────────────────────────────
 
-def main():
+def main(argv=None):
     ap = argparse.ArgumentParser(description="Fetch Mapillary images for a tile with bbox subdivision and pagination.")
     ap.add_argument("--tile-id", required=True, help="Tile id in dash or slash form, e.g. 10-430-720")
     ap.add_argument("--max-images", type=int, default=1200, help="Max images to retrieve overall (0 = no cap)")
@@ -198,12 +495,19 @@ def main():
                     help="If --download-full, pick 1024 or 2048.")
 
     # API pacing / robustness
-    ap.add_argument("--sleep", type=float, default=0.35, help="Seconds to sleep between API pages / cells")
+    ap.add_argument("--sleep", type=float, default=0.35,
+                    help="Initial spacing between API requests in seconds (adapts to HTTP 429s)")
     ap.add_argument("--api-limit", type=int, default=200, help="Per-page limit for Graph API (try 100 if timeouts).")
     ap.add_argument("--page-retries", type=int, default=3, help="Retries per page on HTTP errors/timeouts.")
+    ap.add_argument("--cell-workers", type=int, default=4,
+                    help="Cells paged through concurrently when --subdivide > 1.")
+    ap.add_argument("--http2", action="store_true",
+                    help="Use HTTP/2 (httpx[http2]) for Graph API pages; falls back to HTTP/1.1")
+    ap.add_argument("--download-workers", type=int, default=DOWNLOAD_WORKERS,
+                    help="Concurrent image downloads (across cells).")
 
     ap.add_argument("--out-root", default="data/amsterdam/mapillary", help="Output root directory")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     token = load_token()
     tile = args.tile_id.replace("/", "-")
@@ -223,21 +527,22 @@ def main():
         print(f"[i] Subdividing bbox into {args.subdivide}×{args.subdivide} = {len(cells)} cells")
 
     # Existing & session dedupe
-    existing_ids = read_existing_ids(meta_path)
-    if existing_ids:
-        print(f"[i] Found {len(existing_ids)} existing records in {meta_path}. Will skip duplicates.")
-    seen_ids = set(existing_ids)
+    seen_ids = {id_key(i) for i in load_seen_ids(meta_path)}
+    if seen_ids:
+        print(f"[i] Found {len(seen_ids)} existing records in {meta_path}. Will skip duplicates.")
 
-    # Prepare one session with auth header; avoids putting token in URL
-    sess = requests.Session()
-    sess.headers.update({"Authorization": f"OAuth {token}"})
+    # Prepare one pooled session with auth header; avoids putting token in URL
+    sess = make_api_session(token, http2=args.http2, pool_size=max(args.cell_workers, 10))
 
-    saved_total = 0
+    # One adaptive rate limit for all concurrently listed cells
+    bucket = TokenBucket(1.0 / max(args.sleep, 1e-3))
 
-    for ci, (a, b, c, d) in enumerate(cells, start=1):
-        if args.max_images > 0 and saved_total >= args.max_images:
-            break
+    saved_total = 0
+    stop = threading.Event()  # set once --max-images is reached: listers stop paging
 
+    def list_cell(cell, out: queue.Queue) -> None:
+        """Stream one cell's items (following paging) into `out`, then (HTTP status if it gave up early, error)."""
+        a, b, c, d = cell
         base_url = (
             f"{API_URL}"
             f"?bbox={a},{b},{c},{d}"
@@ -245,11 +550,7 @@ def main():
             f"&image_type=photo"
             f"&limit={args.api_limit}"
         )
-        print(f"[i] Cell {ci}/{len(cells)} bbox=({a:.6f},{b:.6f},{c:.6f},{d:.6f})")
-
-        new_meta = []
-        page_count = 0
-
+        status, err = None, None
         try:
             for it in page_iter(
                 base_url,
@@ -257,7 +558,67 @@ def main():
                 session=sess,
                 retries=args.page_retries,
                 backoff_base=max(0.8, args.sleep),
+                bucket=bucket,
+                stop=stop,
             ):
+                if stop.is_set():
+                    break  # closes page_iter: no further pages requested
+                out.put(it)
+        except HTTP_STATUS_ERRORS as e:
+            status = getattr(e.response, "status_code", None)
+        except BaseException as e:  # re-raised by the consumer, as ex.map did
+            err = e
+        finally:
+            out.put((status, err))
+
+    # Cells are independent: page through them concurrently (at most --cell-workers ahead of
+    # the consumer, to respect API limits) and consume their items in cell order as they
+    # arrive, so dedupe and --max-images behave as before; reaching the cap sets `stop`,
+    # which ends paging in the cells in flight, and no further cells are submitted.
+    # Records are handed to a download pool as soon as they are deduped; each task fetches the
+    # record's images, encodes its line and queues it for the single batching writer, so JSON
+    # encoding and appends overlap the network I/O of other records and of later cells.
+    writer = JsonlWriter(meta_path)
+    dl_pool = ThreadPoolExecutor(max_workers=max(1, args.download_workers))
+    dl_sess = make_download_session(max(1, args.download_workers))
+    dl_futs = []
+    unwinding = False
+
+    def fetch_and_write(rec: dict, jobs) -> None:
+        for field, size, url, path in jobs:
+            if download_file(url, path, session=dl_sess):
+                rec[field] = size
+        writer.put(encode_record(rec))
+
+    n_ahead = max(1, min(args.cell_workers, len(cells)))
+    ex = ThreadPoolExecutor(max_workers=n_ahead)
+    outs = [queue.Queue() for _ in cells]
+
+    def submit_cell(i: int) -> None:
+        if i < len(cells) and not stop.is_set():
+            ex.submit(list_cell, cells[i], outs[i])
+
+    for i in range(n_ahead):
+        submit_cell(i)
+
+    try:
+        for ci, (a, b, c, d) in enumerate(cells, start=1):
+            if args.max_images > 0 and saved_total >= args.max_images:
+                break
+            print(f"[i] Cell {ci}/{len(cells)} bbox=({a:.6f},{b:.6f},{c:.6f},{d:.6f})")
+
+            n_new = 0
+            page_count = 0
+
+            http_status = None
+
+            while True:
+                it = outs[ci - 1].get()
+                if isinstance(it, tuple):  # end of cell
+                    http_status, err = it
+                    if err is not None:
+                        raise err
+                    break
                 page_count += 1
 
                 # Normalize fields
@@ -294,46 +655,60 @@ def main():
                 }
 
                 iid = str(rec["id"])
-                if not iid or iid in seen_ids:
+                if not iid or id_key(iid) in seen_ids:
                     continue
 
+                jobs = []  # (field, size, url, path)
+
                 # Viewer thumbnail
                 if not args.no_thumbs:
                     thumb_url = pick_thumb(rec, args.thumb_size)
                     if thumb_url:
                         jpg_path = img_dir / f"{iid}.jpg"
-                        if not jpg_path.exists() and download_file(thumb_url, jpg_path):
-                            rec["thumb_saved_size"] = args.thumb_size
+                        if not jpg_path.exists():
+                            jobs.append(("thumb_saved_size", args.thumb_size, thumb_url, jpg_path))
 
                 # Optional training image
                 if args.download_full:
                     full_url = pick_thumb(rec, args.full_size)
                     if full_url:
                         full_jpg = img_full_dir / f"{iid}.jpg"
-                        if not full_jpg.exists() and download_file(full_url, full_jpg):
-                            rec["full_saved_size"] = args.full_size
+                        if not full_jpg.exists():
+                            jobs.append(("full_saved_size", args.full_size, full_url, full_jpg))
 
-                new_meta.append(rec)
-                seen_ids.add(iid)
+                dl_futs.append(dl_pool.submit(fetch_and_write, rec, jobs))
+                n_new += 1
+                seen_ids.add(id_key(iid))
                 saved_total += 1
 
                 if args.max_images > 0 and saved_total >= args.max_images:
+                    stop.set()
                     break
-
-        except requests.HTTPError as e:
-            sc = getattr(e.response, "status_code", None)
-            print(f"[warn] Cell {ci}: giving up after retries (HTTP {sc}). Skipping this cell.")
-
-        # Write cell's chunk to disk immediately (safer on long runs)
-        if new_meta:
-            n = append_jsonl(meta_path, new_meta)
-            print(f"[i] Cell {ci}: appended {n} records (pages seen: {page_count}) | total so far: {saved_total}")
-        else:
-            print(f"[i] Cell {ci}: no new records (pages seen: {page_count})")
-
-        time.sleep(args.sleep)  # politeness between cells
-
-    print(f"[i] Saved {saved_total} new records.")
+            submit_cell(ci - 1 + n_ahead)
+
+            if http_status is not None:
+                print(f"[warn] Cell {ci}: giving up after retries (HTTP {http_status}). Skipping this cell.")
+
+            if n_new:
+                print(f"[i] Cell {ci}: queued {n_new} records (pages seen: {page_count}) | total so far: {saved_total}")
+            else:
+                print(f"[i] Cell {ci}: no new records (pages seen: {page_count})")
+    except BaseException:
+        # Error/Ctrl-C: drop queued downloads instead of fetching up to --max-images first;
+        # records whose task never ran are not written (the id index is rebuilt below)
+        unwinding = True
+        raise
+    finally:
+        stop.set()  # cap reached/interrupted: listers in flight stop paging
+        ex.shutdown(wait=False, cancel_futures=True)
+        dl_pool.shutdown(wait=True, cancel_futures=unwinding)
+        n_written = writer.close()
+        # Refresh the id index from what actually reached meta.jsonl (index + appended tail)
+        save_seen_ids(meta_path, load_seen_ids(meta_path))
+    for fut in dl_futs:
+        fut.result()  # re-raise a failed record task, if any
+
+    print(f"[i] Saved {saved_total} new records ({n_written} lines appended).")
     if not args.no_thumbs:
         print(f"[i] Thumbnails in: {img_dir} (~{args.thumb_size}px wide)")
     if args.download_full:
@@ -1,29 +1,43 @@
 # scripts/make_clean_subset.py
 import argparse, json, os, shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.strtree import STRtree
-from shapely import make_valid
-from pyproj import Transformer
+import pyarrow as pa
+import pyarrow.json as paj
+import shapely
 
+from scripts.buildings_cache import TILE_MARGIN_M, load_buildings_and_tree, tile_bbox
 from scripts.tiles import tile_polygon
+from scripts.utils_crs import get_transformer
 
 DEFAULT_LAYER = "lod22_2d"
 FALLBACK_LAYER = "lod13_2d"
-
-def _load_buildings(gpkg_path: Path, layer: str) -> gpd.GeoDataFrame:
+PARQUET_ROW_GROUP = 8192
+JSONL_STRING_COLUMNS = ["id", "captured_at_utc"]
+LINK_WORKERS = 16
+
+def _read_meta_jsonl(jl: Path) -> pd.DataFrame:
+    """
+    Parse meta_28992.jsonl with Arrow's C JSON reader straight into columns; falls back to the
+    line loop on mixed schemas or bad lines. captured_at_utc is pinned to string so Arrow's
+    timestamp inference doesn't change it from what the Parquet path yields.
+    """
     try:
-        gdf = gpd.read_file(gpkg_path, layer=layer)
-    except Exception:
-        gdf = gpd.read_file(gpkg_path, layer=layer, engine="fiona")
-    gdf = gdf.to_crs("EPSG:28992")
-    gdf["geometry"] = gdf.geometry.apply(lambda g: make_valid(g) if g is not None else None)
-    gdf = gdf.explode(index_parts=False, ignore_index=True)
-    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notnull() & gdf.geometry.is_valid].reset_index(drop=True)
-    return gdf
+        schema = pa.schema([(c, pa.string()) for c in JSONL_STRING_COLUMNS])
+        tbl = paj.read_json(jl, read_options=paj.ReadOptions(block_size=8 << 20),
+                            parse_options=paj.ParseOptions(explicit_schema=schema,
+                                                           unexpected_field_behavior="infer"))
+        # explicit fields absent from the file come back as all-null columns: drop them
+        absent = [c for c in JSONL_STRING_COLUMNS if tbl.column(c).null_count == tbl.num_rows]
+        return tbl.drop_columns(absent).to_pandas()
+    except (pa.ArrowInvalid, OSError) as e:
+        print(f"[w] Arrow JSONL read failed for {jl} ({e}); falling back to line-by-line parsing")
+        rows = [json.loads(l) for l in open(jl) if l.strip()]
+        return pd.DataFrame(rows)
 
 def _load_points(tile_dir: Path) -> gpd.GeoDataFrame:
     pq = tile_dir / "meta_28992.parquet"
@@ -31,18 +45,19 @@ def _load_points(tile_dir: Path) -> gpd.GeoDataFrame:
     if pq.exists():
         df = pd.read_parquet(pq)
     else:
-        rows = [json.loads(l) for l in open(jl) if l.strip()]
-        df = pd.DataFrame(rows)
+        df = _read_meta_jsonl(jl)
         if not {"x_28992","y_28992"}.issubset(df.columns):
             if not {"lon","lat"}.issubset(df.columns):
                 raise SystemExit("Need lon/lat or x_28992/y_28992 in meta.")
-            t = Transformer.from_crs("EPSG:4326","EPSG:28992",always_xy=True)
-            x,y = t.transform(df["lon"].astype(float).values, df["lat"].astype(float).values)
+            t = get_transformer("EPSG:4326", "EPSG:28992")
+            x,y = t.transform(df["lon"].to_numpy(dtype=float), df["lat"].to_numpy(dtype=float))
             df["x_28992"], df["y_28992"] = x,y
-    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["x_28992"], df["y_28992"]), crs="EPSG:28992")
+    # One vectorized GEOS constructor call over the coordinate arrays
+    geom = shapely.points(df["x_28992"].to_numpy(dtype=float), df["y_28992"].to_numpy(dtype=float))
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.GeoSeries(geom, index=df.index, crs="EPSG:28992"))
     return gdf
 
-def main():
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--tile-id", required=True)
     ap.add_argument("--mesh-root", default="data/amsterdam/mesh")
@@ -55,7 +70,8 @@ def main():
     ap.add_argument("--dest-name", default="images_clean",
                     help="Destination clean dir name (e.g., 'images_clean' or 'images_full_clean'). Default: images_clean")
     ap.add_argument("--copy", action="store_true", help="Copy files instead of symlinking")
-    args = ap.parse_args()
+    ap.add_argument("--emit-jsonl", action="store_true", help="Also write meta_clean.jsonl (Parquet is always written)")
+    args = ap.parse_args(argv)
 
     tile = args.tile_id
     gpkg = Path(args.mesh_root) / tile / f"{tile}.gpkg"
@@ -63,27 +79,37 @@ def main():
     if not gpkg.exists(): raise SystemExit(f"Missing {gpkg}")
     if not tile_dir.exists(): raise SystemExit(f"Missing {tile_dir}")
 
-    # load buildings
+    poly = tile_polygon(tile)
+
+    # load buildings: same read window as verify_mapping (unless the keep threshold reaches
+    # further), so an in-process verify -> clean run reuses the loaded layer and its STRtree;
+    # thresh <= 0 means unbounded nearest, which needs the whole layer
+    bbox = tile_bbox(poly, max(TILE_MARGIN_M, args.dist_thresh_m)) if args.dist_thresh_m > 0 else None
     try:
-        buildings = _load_buildings(gpkg, args.layer)
+        _, bldg_tree = load_buildings_and_tree(gpkg, args.layer, bbox=bbox)
     except SystemExit:
-        buildings = _load_buildings(gpkg, FALLBACK_LAYER)
+        _, bldg_tree = load_buildings_and_tree(gpkg, FALLBACK_LAYER, bbox=bbox)
 
     # load points
     cams = _load_points(tile_dir)
 
     # inside tile polygon
-    poly = tile_polygon(tile)
-    cams["inside_tile"] = cams.within(poly)
-
-    # distance to buildings via STRtree
-    geoms = list(buildings.geometry.values)
-    tree = STRtree(geoms)
-    dists = []
-    for pt in cams.geometry.values:
-        idx = tree.nearest(pt)
-        dists.append(pt.distance(geoms[idx]) if idx is not None else np.nan)
-    cams["dist_to_bldg_m"] = np.array(dists, dtype=float)
+    # Prepared polygon: GEOS builds its edge index once, then tests all points in one call
+    shapely.prepare(poly)
+    cams["inside_tile"] = shapely.contains(poly, cams.geometry.to_numpy())
+
+    # distance to buildings via STRtree: one bulk nearest query (GEOS computes the distances),
+    # bounded by the keep threshold so the tree search prunes everything farther away
+    pts = cams.geometry.to_numpy()
+    dists = np.full(len(pts), np.nan)
+    if len(bldg_tree) and len(pts):
+        # (input, tree) index pairs; missing/empty points and points with no building within
+        # max_distance are simply absent -> stay NaN (and are dropped by the filter below)
+        (pt_idx, _), d = bldg_tree.query_nearest(
+            pts, max_distance=args.dist_thresh_m if args.dist_thresh_m > 0 else None,
+            return_distance=True, all_matches=False)
+        dists[pt_idx] = d
+    cams["dist_to_bldg_m"] = dists
 
     # filter
     clean = cams[(cams["inside_tile"]) & (cams["dist_to_bldg_m"] <= args.dist_thresh_m)].copy()
@@ -92,13 +118,14 @@ def main():
 
     # write outputs
     out_parq = tile_dir / "meta_clean.parquet"
-    out_jsonl = tile_dir / "meta_clean.jsonl"
-    clean.drop(columns="geometry").to_parquet(out_parq, index=False)
-    with open(out_jsonl, "w") as f:
-        for r in clean.drop(columns="geometry").to_dict(orient="records"):
-            f.write(json.dumps(r) + "\n")
+    clean_df = pd.DataFrame(clean.drop(columns="geometry"))
+    clean_df.to_parquet(out_parq, index=False, engine="pyarrow", compression="zstd",
+                        compression_level=3, row_group_size=PARQUET_ROW_GROUP)
     print(f"[i] Wrote {out_parq}")
-    print(f"[i] Wrote {out_jsonl}")
+    if args.emit_jsonl:
+        out_jsonl = tile_dir / "meta_clean.jsonl"
+        clean_df.to_json(out_jsonl, orient="records", lines=True)
+        print(f"[i] Wrote {out_jsonl}")
 
     # optional: create clean image dir
     if args.symlink_images:
@@ -108,29 +135,38 @@ def main():
         out_img = tile_dir / args.dest_name
         out_img.mkdir(parents=True, exist_ok=True)
 
-        created, missing, skipped = 0, 0, 0
-        for img_id in clean["id"].astype(str):
-            src = src_dir / f"{img_id}.jpg"
-            dst = out_img / f"{img_id}.jpg"
-            if not src.exists():
-                missing += 1
-                continue
-            if dst.exists():
-                skipped += 1
-                continue
+        # One scandir per side instead of two stats per id; resolve the source dir once
+        with os.scandir(src_dir) as it:
+            available = {e.name for e in it}
+        with os.scandir(out_img) as it:
+            present = {e.name for e in it}
+        src_root = src_dir.resolve()
+        names = [f"{img_id}.jpg" for img_id in clean["id"].astype(str)]
+        missing = sum(n not in available for n in names)
+        skipped = sum(n in available and n in present for n in names)
+        todo = list(dict.fromkeys(n for n in names if n in available and n not in present))
+
+        def _place(name: str) -> bool:
+            src, dst = src_root / name, out_img / name
             try:
                 if args.copy:
                     shutil.copy2(src, dst)
                 else:
-                    os.symlink(src.resolve(), dst)
-                created += 1
+                    os.symlink(src, dst)
+                return True
             except Exception:
                 # fallback to copy if symlink not permitted
                 try:
                     shutil.copy2(src, dst)
-                    created += 1
+                    return True
                 except Exception:
-                    missing += 1  # count as missing/failure
+                    return False
+
+        # Syscall-bound (symlink/copy), so a thread pool overlaps the filesystem round-trips
+        with ThreadPoolExecutor(max_workers=LINK_WORKERS) as ex:
+            placed = list(ex.map(_place, todo))
+        created = sum(placed)
+        missing += len(placed) - created  # count failures as missing
 
         print(f"[i] Clean images created: {created} → {out_img} "
               f"(source={args.source_dir}, missing={missing}, already existed={skipped})")
@@ -2,13 +2,17 @@
 from __future__ import annotations
 
 import argparse
-import json
+import os
+from collections import deque
 from pathlib import Path
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
 import pandas as pd
 
+from scripts.utils_json import dumps, loads
+
 def _safe_time(ts: Optional[str]) -> Optional[pd.Timestamp]:
     if not ts or not isinstance(ts, str):
         return None
@@ -17,22 +21,26 @@ def _safe_time(ts: Optional[str]) -> Optional[pd.Timestamp]:
     except Exception:
         return None
 
-def _span_minmax(
-    existing: Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]],
-    cand: Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]
-) -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]:
-    emin, emax = existing
-    cmin, cmax = cand
-    if cmin is not None:
-        emin = cmin if emin is None or cmin < emin else emin
-    if cmax is not None:
-        emax = cmax if emax is None or cmax > emax else emax
-    return emin, emax
+def _parse_times(values: List[Any]) -> pd.Series:
+    """Parse all timestamp strings in one vectorized call; non-strings and bad values become NaT."""
+    strs = pd.Series([v if isinstance(v, str) and v else None for v in values], dtype=object)
+    parsed = pd.to_datetime(strs, utc=True, errors="coerce", format="ISO8601")
+    # Rare off-format strings: per-value parse as before
+    for i in parsed.index[parsed.isna() & strs.notna()]:
+        t = _safe_time(strs.iat[i])
+        if t is not None and not pd.isna(t):
+            parsed.iat[i] = t
+    return parsed
+
+def _span_of(lo: pd.Series, hi: pd.Series) -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]:
+    smin, smax = lo.min(), hi.max()
+    return (None if pd.isna(smin) else smin, None if pd.isna(smax) else smax)
+
+def _fmt_ts(t: Optional[pd.Timestamp]) -> Optional[str]:
+    return t.isoformat().replace("+00:00", "Z") if t is not None else None
 
 def _fmt_span(span: Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]) -> List[Optional[str]]:
-    smin, smax = span
-    f = lambda t: t.isoformat().replace("+00:00", "Z") if t is not None else None
-    return [f(smin), f(smax)]
+    return [_fmt_ts(span[0]), _fmt_ts(span[1])]
 
 def _sum_opt(a: Optional[int], b: Optional[int]) -> Optional[int]:
     if a is None and b is None:
@@ -55,24 +63,107 @@ def _union_bounds(existing: Optional[List[float]], cand: Optional[List[float]])
 def _count_jpegs(dir_path: Optional[str]) -> Optional[int]:
     if not dir_path:
         return None
-    p = Path(dir_path)
-    if not p.exists():
-        return None
     try:
-        return sum(1 for _ in p.glob("*.jpg"))
-    except Exception:
+        with os.scandir(dir_path) as it:
+            return sum(1 for e in it if e.name.endswith(".jpg"))
+    except OSError:
         return None
 
 def _iter_tile_manifests(root: Path) -> List[Path]:
     # Expect structure: <root>/<tile_id>/manifest.json
-    out: List[Path] = []
-    for sub in sorted(root.iterdir()):
-        if not sub.is_dir():
-            continue
-        mf = sub / "manifest.json"
-        if mf.exists():
-            out.append(mf)
-    return out
+    # DirEntry.is_dir() uses the readdir type; manifest.json is not stat'ed here,
+    # a missing one is skipped when _process_manifest fails to open it.
+    with os.scandir(root) as it:
+        names = sorted(e.name for e in it if e.is_dir())
+    return [root / name / "manifest.json" for name in names]
+
+def _process_manifest(mf: Path) -> Optional[Dict[str, Any]]:
+    """Parse one tile manifest and fill in missing image counts from disk."""
+    try:
+        data = loads(mf.read_bytes())
+    except FileNotFoundError:
+        return None  # tile dir without a manifest
+    except Exception:
+        print(f"[warn] Failed to read {mf}, skipping.")
+        return None
+
+    tile_id = data.get("tile_id") or mf.parent.name
+    crs = data.get("crs", "EPSG:28992")
+
+    # Mapillary counts/time spans (favor what's in manifest, but fall back to dir counts if missing)
+    mp = data.get("mapillary") or {}
+    counts = (mp.get("counts") or {})
+    times = (mp.get("time_spans") or {})
+
+    c_raw = counts.get("raw")
+    c_clean = counts.get("clean")
+
+    # If image dir counts are missing in manifest, compute now
+    img_dir = mp.get("images_dir")
+    img_clean_dir = mp.get("images_clean_dir")
+    img_full_dir = mp.get("images_full_dir")
+    img_full_clean_dir = mp.get("images_full_clean_dir")
+
+    c_images = counts.get("images")
+    c_images_clean = counts.get("images_clean")
+    c_images_full = counts.get("images_full")
+    c_images_full_clean = counts.get("images_full_clean")
+
+    if c_images is None:
+        c_images = _count_jpegs(img_dir)
+    if c_images_clean is None:
+        c_images_clean = _count_jpegs(img_clean_dir)
+    if c_images_full is None:
+        c_images_full = _count_jpegs(img_full_dir)
+    if c_images_full_clean is None:
+        c_images_full_clean = _count_jpegs(img_full_clean_dir)
+
+    # Time spans
+    raw_s = times.get("raw") or [None, None]
+    clean_s = times.get("clean") or [None, None]
+
+    # Per-tile summary (compact)
+    tile_entry = {
+        "tile_id": tile_id,
+        "manifest_path": str(mf),
+        "crs": crs,
+        "has_mesh": bool(data.get("mesh", {}).get("gpkg")),
+        "has_aerial": bool((data.get("aerial") or {}).get("tifs")),
+        "has_mapillary": bool(data.get("mapillary")),
+        "mapillary": {
+            "counts": {
+                "raw": c_raw,
+                "clean": c_clean,
+                "images": c_images,
+                "images_clean": c_images_clean,
+                "images_full": c_images_full,
+                "images_full_clean": c_images_full_clean,
+            },
+            "time_spans": {
+                "raw": raw_s,
+                "clean": clean_s,
+            },
+        },
+    }
+    return {
+        "entry": tile_entry,
+        "created_at": data.get("created_at"),
+        "bounds_28992": (data.get("mesh") or {}).get("bounds_28992"),
+    }
+
+def _map_bounded(ex: ThreadPoolExecutor, fn, items: List[Any], window: int):
+    """Like ex.map(fn, items) in order, but with at most `window` calls in flight or unconsumed."""
+    pending: deque = deque()
+    it = iter(items)
+    for item in it:
+        pending.append(ex.submit(fn, item))
+        if len(pending) >= window:
+            break
+    while pending:
+        yield pending.popleft().result()
+        for item in it:
+            pending.append(ex.submit(fn, item))
+            break
 
 def main():
     ap = argparse.ArgumentParser(description="Merge per-tile manifests into a single index.json")
@@ -91,14 +182,8 @@ def main():
     if not manifests:
         raise SystemExit(f"No manifests found under {root}")
 
-    tiles: List[Dict[str, Any]] = []
-
     # Global aggregations
     tiles_count = 0
-    created_span = (None, None)  # across tile manifests
-    raw_span = (None, None)
-    clean_span = (None, None)
-
     sum_raw = None
     sum_clean = None
     sum_images = None
@@ -107,99 +192,70 @@ def main():
     sum_images_full_clean = None
 
     union_bounds_28992: Optional[List[float]] = None
+    ts_buf: List[Any] = []
 
-    for mf in manifests:
-        try:
-            data = json.loads(mf.read_text(encoding="utf-8"))
-        except Exception:
-            print(f"[warn] Failed to read {mf}, skipping.")
-            continue
-
-        tile_id = data.get("tile_id") or mf.parent.name
-        crs = data.get("crs", "EPSG:28992")
-
-        # Manifest creation times
-        created_at = _safe_time(data.get("created_at"))
-        created_span = _span_minmax(created_span, (created_at, created_at))
-
-        # Mesh bounds union
-        mesh = data.get("mesh") or {}
-        union_bounds_28992 = _union_bounds(union_bounds_28992, mesh.get("bounds_28992"))
-
-        # Mapillary counts/time spans (favor what's in manifest, but fall back to dir counts if missing)
-        mp = data.get("mapillary") or {}
-        counts = (mp.get("counts") or {})
-        times = (mp.get("time_spans") or {})
-
-        c_raw = counts.get("raw")
-        c_clean = counts.get("clean")
-
-        # If image dir counts are missing in manifest, compute now
-        img_dir = mp.get("images_dir")
-        img_clean_dir = mp.get("images_clean_dir")
-        img_full_dir = mp.get("images_full_dir")
-        img_full_clean_dir = mp.get("images_full_clean_dir")
-
-        c_images = counts.get("images")
-        c_images_clean = counts.get("images_clean")
-        c_images_full = counts.get("images_full")
-        c_images_full_clean = counts.get("images_full_clean")
-
-        if c_images is None:
-            c_images = _count_jpegs(img_dir)
-        if c_images_clean is None:
-            c_images_clean = _count_jpegs(img_clean_dir)
-        if c_images_full is None:
-            c_images_full = _count_jpegs(img_full_dir)
-        if c_images_full_clean is None:
-            c_images_full_clean = _count_jpegs(img_full_clean_dir)
-
-        # Time spans
-        raw_s = times.get("raw") or [None, None]
-        clean_s = times.get("clean") or [None, None]
-        raw_span = _span_minmax(raw_span, (_safe_time(raw_s[0]), _safe_time(raw_s[1])))
-        clean_span = _span_minmax(clean_span, (_safe_time(clean_s[0]), _safe_time(clean_s[1])))
-
-        # Global sums
-        sum_raw = _sum_opt(sum_raw, c_raw)
-        sum_clean = _sum_opt(sum_clean, c_clean)
-        sum_images = _sum_opt(sum_images, c_images)
-        sum_images_clean = _sum_opt(sum_images_clean, c_images_clean)
-        sum_images_full = _sum_opt(sum_images_full, c_images_full)
-        sum_images_full_clean = _sum_opt(sum_images_full_clean, c_images_full_clean)
-
-        # Per-tile summary (compact)
-        tile_entry = {
-            "tile_id": tile_id,
-            "manifest_path": str(mf),
-            "crs": crs,
-            "has_mesh": bool(data.get("mesh", {}).get("gpkg")),
-            "has_aerial": bool((data.get("aerial") or {}).get("tifs")),
-            "has_mapillary": bool(data.get("mapillary")),
-            "mapillary": {
-                "counts": {
-                    "raw": c_raw,
-                    "clean": c_clean,
-                    "images": c_images,
-                    "images_clean": c_images_clean,
-                    "images_full": c_images_full,
-                    "images_full_clean": c_images_full_clean,
-                },
-                "time_spans": {
-                    "raw": raw_s,
-                    "clean": clean_s,
-                },
-            },
+    # Stream index.json: header and per-tile entries while reducing, summary last,
+    # into a temp file that replaces the target only once complete.
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    f = open(tmp_path, "wb")
+    # Manifest parsing and jpeg counting are stat/readdir bound: fan out on threads,
+    # then reduce serially in manifest order so the output stays deterministic.
+    workers = min(32, len(manifests))
+    ex = ThreadPoolExecutor(max_workers=workers)
+    try:
+        header = {
+            "created_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "root": str(root),
+            "version": 1,
         }
-        tiles.append(tile_entry)
-        tiles_count += 1
-
-    # Build index.json
-    index: Dict[str, Any] = {
-        "created_at": datetime.utcnow().isoformat() + "Z",
-        "root": str(root),
-        "version": 1,
-        "summary": {
+        f.write(b"{\n")
+        for k, v in header.items():
+            f.write(b"  " + dumps(k) + b": " + dumps(v) + b",\n")
+        if not args.skip_tiles:
+            f.write(b'  "tiles": [')
+
+        for res in _map_bounded(ex, _process_manifest, manifests, window=4 * workers):
+            if res is None:
+                continue
+            tile_entry = res["entry"]
+            counts = tile_entry["mapillary"]["counts"]
+            times = tile_entry["mapillary"]["time_spans"]
+
+            # Mesh bounds union
+            union_bounds_28992 = _union_bounds(union_bounds_28992, res["bounds_28992"])
+
+            # Timestamps: [created_at, raw start, raw end, clean start, clean end], parsed in bulk below
+            ts_buf.extend([res["created_at"], times["raw"][0], times["raw"][1],
+                           times["clean"][0], times["clean"][1]])
+
+            # Global sums
+            sum_raw = _sum_opt(sum_raw, counts["raw"])
+            sum_clean = _sum_opt(sum_clean, counts["clean"])
+            sum_images = _sum_opt(sum_images, counts["images"])
+            sum_images_clean = _sum_opt(sum_images_clean, counts["images_clean"])
+            sum_images_full = _sum_opt(sum_images_full, counts["images_full"])
+            sum_images_full_clean = _sum_opt(sum_images_full_clean, counts["images_full_clean"])
+
+            if not args.skip_tiles:
+                f.write((b",\n    " if tiles_count else b"\n    ") + dumps(tile_entry))
+            tiles_count += 1
+
+        # Only stat in the degenerate case, to keep the "nothing found" error
+        if not tiles_count and not any(mf.exists() for mf in manifests):
+            raise SystemExit(f"No manifests found under {root}")
+
+        if not args.skip_tiles:
+            f.write(b"\n  ],\n" if tiles_count else b"],\n")
+
+        # Time spans across tile manifests
+        parsed = _parse_times(ts_buf)
+        created = parsed.iloc[0::5]
+        created_span = _span_of(created, created)
+        raw_span = _span_of(parsed.iloc[1::5], parsed.iloc[2::5])
+        clean_span = _span_of(parsed.iloc[3::5], parsed.iloc[4::5])
+
+        summary: Dict[str, Any] = {
             "tiles": tiles_count,
             "mapillary_counts": {
                 "raw": sum_raw,
@@ -215,14 +271,16 @@ def main():
                 "clean": _fmt_span(clean_span),
             },
             "bounds_28992": union_bounds_28992,
-        },
-    }
-
-    if not args.skip_tiles:
-        index["tiles"] = tiles
-
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text(json.dumps(index, indent=2), encoding="utf-8")
+        }
+        f.write(b'  "summary": ' + dumps(summary, indent=True).replace(b"\n", b"\n  ") + b"\n}\n")
+        f.close()
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        f.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        ex.shutdown(cancel_futures=True)
     print(f"[i] Wrote {out_path}")
 
 if __name__ == "__main__":
@@ -1,53 +1,115 @@
 # scripts/plot_tile_overlay.py
-import json
+import mmap
 import argparse
 from pathlib import Path
 
+import numpy as np
 import geopandas as gpd
+import pyogrio
 import matplotlib.pyplot as plt
-from shapely.geometry import Point, box
-from pyproj import Transformer
+
+from scripts.utils_crs import is_rd_new, to_28992_arr
+from scripts.utils_json import loads
 
 DEFAULT_LAYER = "lod22_2d"
 FALLBACK_LAYER = "lod13_2d"
 
 
+def _count_lines(mm: mmap.mmap) -> int:
+    """Upper bound on the line count, scanning the map in place (no bytes copy)."""
+    n, pos = 1, mm.find(b"\n")  # last line may lack a newline
+    while pos != -1:
+        n += 1
+        pos = mm.find(b"\n", pos + 1)
+    return n
+
+
 def load_meta_points_jsonl(meta_path: Path):
-    """Load (lon, lat) from meta.jsonl."""
-    pts_4326 = []
-    with open(meta_path, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    """Load (lons, lats) float64 arrays from meta.jsonl."""
+    if meta_path.stat().st_size == 0:
+        return np.empty(0), np.empty(0)
+    with open(meta_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, "madvise"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        n = _count_lines(mm)
+        lons = np.empty(n, dtype=np.float64)
+        lats = np.empty(n, dtype=np.float64)
+        i = 0
+        for line in iter(mm.readline, b""):
+            if not line.strip():
                 continue
-            j = json.loads(line)
+            j = loads(line)
             lon, lat = j.get("lon"), j.get("lat")
             if lon is None or lat is None:
                 continue
-            pts_4326.append((lon, lat))
-    return pts_4326
+            lons[i] = lon
+            lats[i] = lat
+            i += 1
+    return lons[:i], lats[:i]
+
+
+def points_geodf_from_lonlat(lons, lats):
+    """Project lon/lat arrays to EPSG:28992 in one array transform."""
+    xs, ys = to_28992_arr(lons, lats)
+    return gpd.GeoDataFrame(geometry=gpd.points_from_xy(xs, ys), crs="EPSG:28992")
+
+
+def load_points_geodf_from_parquet(pq_path: Path, columns=("x_28992", "y_28992"), bbox=None):
+    """
+    Load projected points (EPSG:28992) directly from Parquet, reading only `columns`.
+    With bbox=(minx, miny, maxx, maxy) the range filter is pushed into the scan, so row
+    groups whose x/y statistics fall outside are skipped without decoding.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    cols = list(dict.fromkeys(["x_28992", "y_28992", *columns]))
+    if bbox is not None:
+        dset = ds.dataset(str(pq_path), format="parquet")
+        if not {"x_28992", "y_28992"}.issubset(dset.schema.names):
+            raise ValueError(f"{pq_path} missing x_28992/y_28992 columns")
+        minx, miny, maxx, maxy = bbox
+        x, y = ds.field("x_28992"), ds.field("y_28992")
+        flt = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+        tbl = dset.to_table(columns=cols, filter=flt)
+    else:
+        # Memory-mapped source: pages for the selected column chunks are faulted in on demand
+        with pa.memory_map(str(pq_path), "r") as source:
+            pf = pq.ParquetFile(source)
+            if not {"x_28992", "y_28992"}.issubset(pf.schema_arrow.names):
+                raise ValueError(f"{pq_path} missing x_28992/y_28992 columns")
+            tbl = pf.read(columns=cols)
+    xs = tbl.column("x_28992").to_numpy()
+    ys = tbl.column("y_28992").to_numpy()
+    extra = [c for c in cols if c not in ("x_28992", "y_28992")]
+    df = tbl.select(extra).to_pandas() if extra else None
+    gpts = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(xs, ys), crs="EPSG:28992")
+    return gpts
 
 
-def load_points_geodf_from_parquet(pq_path: Path):
-    """Load projected points (EPSG:28992) directly from Parquet if available."""
-    import pandas as pd
-    df = pd.read_parquet(pq_path)
-    if not {"x_28992", "y_28992"}.issubset(df.columns):
-        raise ValueError(f"{pq_path} missing x_28992/y_28992 columns")
-    gpts = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["x_28992"], df["y_28992"]), crs="EPSG:28992")
-    return gpts
+def parquet_num_rows(pq_path: Path) -> int:
+    """Row count from the Parquet footer (no data pages read)."""
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(pq_path).metadata.num_rows
 
 
 def load_buildings_gpkg(gpkg_path: Path, layer: str):
     """Read a specific layer from the GPKG and reproject to EPSG:28992."""
-    # Try fast path (pyogrio), then Fiona fallback
+    # Try fast path (pyogrio; geometry only, attributes are never plotted), then Fiona fallback
     try:
-        buildings = gpd.read_file(gpkg_path, layer=layer)
+        buildings = pyogrio.read_dataframe(gpkg_path, layer=layer, columns=[], force_2d=True)
     except Exception as e:
         print(f"[w] Could not read '{layer}' via pyogrio: {e}\n[i] Retrying with Fiona engine…")
         buildings = gpd.read_file(gpkg_path, layer=layer, engine="fiona")
 
-    # Reproject to EPSG:28992 (from EPSG:7415 compound or whatever original CRS is)
+    # Already RD New: relabel instead of pushing every vertex through PROJ
+    crs = buildings.crs
+    if is_rd_new(crs):
+        if crs.to_epsg() != 28992:
+            buildings = buildings.set_crs("EPSG:28992", allow_override=True)
+        return buildings
+
+    # Reproject to EPSG:28992 (whatever the original CRS is)
     try:
         buildings = buildings.to_crs("EPSG:28992")
     except Exception as e:
@@ -65,6 +127,8 @@ def main():
     ap.add_argument("--save", default=None, help="Optional path to save PNG (e.g., outputs/overlay.png)")
     ap.add_argument("--point-size", type=float, default=6.0, help="Marker size for points")
     ap.add_argument("--alpha", type=float, default=0.9, help="Alpha for points")
+    ap.add_argument("--show-outside", action="store_true",
+                    help="Also load and plot points outside the tile bbox (reads every Parquet row)")
     args = ap.parse_args()
 
     tile = args.tile_id
@@ -89,28 +153,31 @@ def main():
         else:
             raise
 
+    minx, miny, maxx, maxy = buildings.total_bounds
+    bbox = None if args.show_outside else (minx, miny, maxx, maxy)
+
     # --- Load points: prefer Parquet (already in EPSG:28992), else JSONL (transform) ---
+    n_total = None
     if meta_pq.exists():
         try:
-            gpts = load_points_geodf_from_parquet(meta_pq)
+            gpts = load_points_geodf_from_parquet(meta_pq, bbox=bbox)
+            if bbox is not None:
+                n_total = parquet_num_rows(meta_pq)
             print(f"[i] Loaded points from {meta_pq} (projected).")
-        except Exception as e:
+        except (OSError, ValueError) as e:  # pyarrow's ArrowIOError/ArrowInvalid subclass these
+            if not meta_jsonl.exists():
+                raise SystemExit(f"Failed to load {meta_pq}: {e}")
             print(f"[w] Failed to load Parquet: {e}\n[i] Falling back to meta.jsonl…")
-            pts_4326 = load_meta_points_jsonl(meta_jsonl)
-            t = Transformer.from_crs("EPSG:4326", "EPSG:28992", always_xy=True)
-            pts_28992 = [Point(*t.transform(lon, lat)) for lon, lat in pts_4326]
-            gpts = gpd.GeoDataFrame(geometry=pts_28992, crs="EPSG:28992")
+            gpts = points_geodf_from_lonlat(*load_meta_points_jsonl(meta_jsonl))
     else:
-        pts_4326 = load_meta_points_jsonl(meta_jsonl)
-        t = Transformer.from_crs("EPSG:4326", "EPSG:28992", always_xy=True)
-        pts_28992 = [Point(*t.transform(lon, lat)) for lon, lat in pts_4326]
-        gpts = gpd.GeoDataFrame(geometry=pts_28992, crs="EPSG:28992")
+        gpts = points_geodf_from_lonlat(*load_meta_points_jsonl(meta_jsonl))
 
     # --- Stats: inside vs outside tile bounds ---
-    minx, miny, maxx, maxy = buildings.total_bounds
-    tile_bbox = gpd.GeoSeries([box(minx, miny, maxx, maxy)], crs="EPSG:28992")
-    inside_mask = gpts.within(tile_bbox.iloc[0])
-    n_total = len(gpts)
+    xs = gpts.geometry.x.to_numpy()
+    ys = gpts.geometry.y.to_numpy()
+    inside_mask = (xs >= minx) & (xs <= maxx) & (ys >= miny) & (ys <= maxy)
+    if n_total is None:
+        n_total = len(gpts)
     n_inside = int(inside_mask.sum())
     n_outside = n_total - n_inside
     print(f"[i] Total points: {n_total} | inside tile bbox: {n_inside} | outside: {n_outside}")
@@ -119,7 +186,7 @@ def main():
     fig, ax = plt.subplots(figsize=(8, 8))
     buildings.plot(ax=ax, edgecolor="black", facecolor="none", linewidth=0.5)
     # plot inside points brighter, outside lighter (if any)
-    if n_outside > 0:
+    if args.show_outside and n_outside > 0:
         gpts[~inside_mask].plot(ax=ax, markersize=args.point_size, alpha=0.3)
     if n_inside > 0:
         gpts[inside_mask].plot(ax=ax, markersize=args.point_size, alpha=args.alpha)
@@ -1,14 +1,26 @@
 # scripts/select_tiles.py
 import argparse
 import csv
+import os
+import tempfile
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from shapely.strtree import STRtree
 from shapely.geometry import Point, box, shape
-from shapely.ops import transform as shp_transform
-from pyproj import Transformer
+
+from scripts.utils_crs import get_transformer
 
 TILE_INDEX = "data/amsterdam/mesh/tile_index.fgb"  # EPSG:28992
+TILE_INDEX_CACHE = "data/amsterdam/mesh/tile_index.wkb.parquet"  # tile_id + WKB geometry
+
+_INDEX = None  # (tile_id array, STRtree over the index geometries)
+_TID_INDEX = None  # slash-form tile_id -> row position in _INDEX
 
 def _to_dash(tid: str) -> str:
     return tid.replace("/", "-")
@@ -27,6 +39,13 @@ def _parse_tile_id(tid: str):
         return z, x, y
     raise ValueError(f"Bad tile id: {tid}")
 
+def _parse_tile_ids(tids):
+    """Vectorized _parse_tile_id for slash-form index ids -> [(z, x, y), ...]."""
+    if len(tids) == 0:
+        return []
+    zxy = pd.Series(tids, dtype=object).str.split("/", expand=True).astype(int).to_numpy()
+    return [tuple(r) for r in zxy.tolist()]
+
 def _neighbors(z:int, x:int, y:int, k:int):
     tiles=[]
     for dx in range(-k, k+1):
@@ -35,17 +54,61 @@ def _neighbors(z:int, x:int, y:int, k:int):
     return tiles
 
 def _project_geom_4326_to_28992(geom):
-    t = Transformer.from_crs("EPSG:4326","EPSG:28992", always_xy=True).transform
-    return shp_transform(t, geom)
+    # shapely.transform hands over every coordinate as one (N, 2) array -> a single PROJ call
+    t = get_transformer("EPSG:4326", "EPSG:28992")
+    return shapely.transform(geom, lambda xy: np.column_stack(t.transform(xy[:, 0], xy[:, 1])))
+
+def _set_index(tile_ids, tree):
+    global _INDEX, _TID_INDEX
+    _INDEX = (tile_ids, tree)
+    _TID_INDEX = {t: i for i, t in enumerate(tile_ids.tolist())}
+    return _INDEX
 
 def _load_index():
+    """
+    (tile_ids, STRtree) over the index geometries, cached in-process. The ids and WKB
+    geometries are kept in a Parquet sidecar next to the .fgb (rewritten when the source
+    mtime changes), which skips the OGR read; the STRtree itself is built on every load.
+    """
+    if _INDEX is not None:
+        return _INDEX
+    src_mtime = os.stat(TILE_INDEX).st_mtime_ns
+    cache = Path(TILE_INDEX_CACHE)
+    if cache.exists():
+        try:
+            tbl = pq.read_table(cache)
+            meta = tbl.schema.metadata or {}
+            if meta.get(b"source_mtime_ns") == str(src_mtime).encode():
+                tile_ids = tbl.column("tile_id").to_numpy(zero_copy_only=False).astype(str)
+                geoms = shapely.from_wkb(tbl.column("wkb").to_numpy(zero_copy_only=False))
+                return _set_index(tile_ids, STRtree(geoms))
+        except (pa.ArrowException, OSError, KeyError, shapely.errors.GEOSException) as e:
+            print(f"[w] Ignoring unreadable {cache}: {e}")
+
     g = gpd.read_file(TILE_INDEX)  # EPSG:28992
     if g.crs is None or g.crs.to_epsg() != 28992:
         g = g.set_crs(28992, allow_override=True)
-    return g
-
-def _filter_by_geom_28992(gidx, geom):
-    return gidx[gidx.geometry.intersects(geom)]
+    tile_ids = g["tile_id"].astype(str).to_numpy()
+    geoms = g.geometry.values
+    tmp = None
+    try:
+        tbl = pa.table({"tile_id": pa.array(tile_ids, pa.string()),
+                        "wkb": pa.array(shapely.to_wkb(np.asarray(geoms)), pa.binary())})
+        tbl = tbl.replace_schema_metadata({"source_mtime_ns": str(src_mtime)})
+        fd, tmp = tempfile.mkstemp(dir=cache.parent, prefix=cache.name + ".", suffix=".tmp")
+        os.close(fd)
+        pq.write_table(tbl, tmp)
+        os.replace(tmp, cache)
+    except (pa.ArrowException, OSError) as e:
+        print(f"[w] Could not write {cache}: {e}")
+        if tmp and os.path.exists(tmp):
+            os.unlink(tmp)
+    return _set_index(tile_ids, STRtree(geoms))
+
+def _filter_by_geom_28992(index, geom):
+    tile_ids, tree = index
+    idx = tree.query(geom, predicate="intersects")
+    return tile_ids[np.sort(idx)]
 
 def _write_csv(out_path, tile_ids):
     out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -82,7 +145,8 @@ def main():
     s4.add_argument("--geojson", required=True, help="Path to a GeoJSON with Polygon/MultiPolygon (EPSG:4326)")
 
     args = ap.parse_args()
-    gidx = _load_index()
+    index = _load_index()
+    tile_ids_all = index[0]
 
     tile_ids = []
 
@@ -94,40 +158,33 @@ def main():
         # Keep only neighbors that actually exist in index (match on tile_id column if present)
         # tile_index uses slash format in 'tile_id' like '10/430/720'
         slash_ids = [f"{z}/{x}/{y}" for (z,x,y) in nb]
-        hit = gidx[gidx["tile_id"].isin(slash_ids)]
-        if hit.empty:
+        rows = [_TID_INDEX[s] for s in slash_ids if s in _TID_INDEX]
+        hit = tile_ids_all[rows]
+        if hit.size == 0:
             print("[w] No neighbors found in index — check z/x/y.")
         else:
-            for tid in hit["tile_id"].tolist():
-                tz, tx, ty = _parse_tile_id(tid)
-                tile_ids.append((tz, tx, ty))
+            tile_ids.extend(_parse_tile_ids(hit))
 
     elif args.mode == "around-point":
         # make a buffer circle (in 28992) around the projected point
         p28992 = _project_geom_4326_to_28992(Point(args.lon, args.lat))
         circle = p28992.buffer(args.radius_m)
-        hit = _filter_by_geom_28992(gidx, circle)
-        for tid in hit["tile_id"].tolist():
-            tz, tx, ty = _parse_tile_id(tid)
-            tile_ids.append((tz, tx, ty))
+        hit = _filter_by_geom_28992(index, circle)
+        tile_ids.extend(_parse_tile_ids(hit))
 
     elif args.mode == "bbox":
         poly_wgs84 = box(args.minlon, args.minlat, args.maxlon, args.maxlat)
         poly_28992 = _project_geom_4326_to_28992(poly_wgs84)
-        hit = _filter_by_geom_28992(gidx, poly_28992)
-        for tid in hit["tile_id"].tolist():
-            tz, tx, ty = _parse_tile_id(tid)
-            tile_ids.append((tz, tx, ty))
+        hit = _filter_by_geom_28992(index, poly_28992)
+        tile_ids.extend(_parse_tile_ids(hit))
 
     elif args.mode == "polygon":
         gj = gpd.read_file(args.geojson)  # expecting EPSG:4326
         if gj.crs is None or gj.crs.to_epsg() != 4326:
             gj = gj.set_crs(4326, allow_override=True)
-        geom_28992 = gj.to_crs(28992).unary_union
-        hit = _filter_by_geom_28992(gidx, geom_28992)
-        for tid in hit["tile_id"].tolist():
-            tz, tx, ty = _parse_tile_id(tid)
-            tile_ids.append((tz, tx, ty))
+        geom_28992 = shapely.unary_union(gj.to_crs(28992).geometry.values)
+        hit = _filter_by_geom_28992(index, geom_28992)
+        tile_ids.extend(_parse_tile_ids(hit))
 
     _write_csv(Path(args.out), tile_ids)
 
@@ -1,9 +1,11 @@
 import os
 import re
+from functools import lru_cache
 import geopandas as gpd
+import pandas as pd
 from shapely.geometry import Point
 from typing import Optional, Tuple
-from scripts.utils_crs import to_4326, to_28992
+from scripts.utils_crs import to_4326_arr, to_28992
 
 # Default path; override by passing load_tiles(path=...) if needed
 DEFAULT_TILE_INDEX = "data/amsterdam/mesh/tile_index.fgb"
@@ -11,6 +13,11 @@ _DOWNLOAD_COLS = ["cj_download", "gpkg_download", "obj_download"]
 
 _TILES_GDF = None
 _ID_COL = None
+_LOOKUP = None  # tile id (slash- or dash-form) -> row position in _TILES_GDF
+# Dash-form tile id in a 3D BAG download URL, e.g. .../10-430-720.gpkg
+RE_DASH_ID_IN_URL = re.compile(r"/([0-9]+-[0-9]+-[0-9]+)\.(?:zip|gpkg|city\.json)$", re.IGNORECASE)
+# RE2 (pyarrow.compute) spelling of RE_DASH_ID_IN_URL, for extracting ids column-wise
+RE2_DASH_ID_IN_URL = r"/(?P<dash_id>[0-9]+-[0-9]+-[0-9]+)\.(?i:zip|gpkg|city\.json)$"
 
 def _detect_id_col(gdf):
     """Pick a reasonable ID column from common names, else first string-like column."""
@@ -35,37 +42,45 @@ def load_tiles(path: str = DEFAULT_TILE_INDEX):
             raise ValueError(f"Could not detect ID column in {path}. Columns: {list(g.columns)}")
     return _TILES_GDF
 
-def _row_by_dash_id(gdf, dash_id: str):
+def _tile_lookup(path: str = DEFAULT_TILE_INDEX) -> dict:
     """
-    Find the row whose download URLs contain the dash-form id (e.g., '8-328-552').
-    Matches '/8-328-552.' or '/8-328-552/' or end-of-string.
+    One-time {tile id: row position} map over the index: ID-column values plus the dash ids
+    found in the download URLs, with the same precedence as the original per-call scans.
     """
-    pat = rf"/{re.escape(dash_id)}(?:\.|/|$)"
-    for col in ["cj_download", "gpkg_download", "obj_download"]:
-        if col in gdf.columns:
-            mask = gdf[col].astype(str).str.contains(pat, regex=True, na=False)
-            hit = gdf[mask]
-            if not hit.empty:
-                return hit.iloc[0]
-    return None
+    global _LOOKUP
+    if _LOOKUP is None:
+        g = load_tiles(path)
+        pos = pd.RangeIndex(len(g))
+        url_sources = []
+        for col in _DOWNLOAD_COLS:
+            if col in g.columns:
+                ids = g[col].astype(str).str.extract(RE_DASH_ID_IN_URL, expand=False)
+                url_sources.append(pd.Series(pos, index=ids.values)[ids.notna().values])
+        dash = {}
+        for src in reversed(url_sources):  # lowest precedence first; first row wins within a source
+            src = src[~src.index.duplicated(keep="first")]
+            dash.update(zip(src.index, src.values.tolist()))
+        ids = pd.Series(pos, index=g[_ID_COL].astype(str))
+        ids = ids[~ids.index.duplicated(keep="first")]
+        lut = dash
+        lut.update(zip(ids.index, ids.values.tolist()))
+        _LOOKUP = lut
+    return _LOOKUP
 
+@lru_cache(maxsize=4096)
 def tile_polygon(tile_id: str, path: str = DEFAULT_TILE_INDEX):
     """
     Accepts either slash-form (e.g., '8/760/72') or dash-form (e.g., '8-328-552').
     Returns shapely Polygon/MultiPolygon in EPSG:28992, or None if not found.
+    Memoized (shapely geometries are immutable, so sharing them is safe).
     """
     g = load_tiles(path)
-    # Direct match on the detected ID column (slash-form)
-    direct = g.loc[g[_ID_COL].astype(str) == str(tile_id)]
-    if not direct.empty:
-        return direct.iloc[0].geometry
-    # Dash-form via download URL columns
-    if "-" in str(tile_id):
-        row = _row_by_dash_id(g, str(tile_id))
-        if row is not None:
-            return row.geometry
+    i = _tile_lookup(path).get(str(tile_id))
+    if i is not None:
+        return g.geometry.iloc[i]
     return None
 
+@lru_cache(maxsize=4096)
 def tile_bbox_28992(tile_id: str, margin_m: float = 0.0, path: str = DEFAULT_TILE_INDEX) -> Optional[Tuple[float,float,float,float]]:
     poly = tile_polygon(tile_id, path)
     if poly is None:
@@ -75,16 +90,14 @@ def tile_bbox_28992(tile_id: str, margin_m: float = 0.0, path: str = DEFAULT_TIL
         return (minx - margin_m, miny - margin_m, maxx + margin_m, maxy + margin_m)
     return (minx, miny, maxx, maxy)
 
+@lru_cache(maxsize=4096)
 def tile_bbox_4326(tile_id: str, margin_m: float = 0.0, path: str = DEFAULT_TILE_INDEX) -> Optional[Tuple[float,float,float,float]]:
     b = tile_bbox_28992(tile_id, margin_m, path)
     if b is None:
         return None
     minx, miny, maxx, maxy = b
-    bl = to_4326(minx, miny)
-    tr = to_4326(maxx, maxy)
-    minlon, minlat = min(bl[0], tr[0]), min(bl[1], tr[1])
-    maxlon, maxlat = max(bl[0], tr[0]), max(bl[1], tr[1])
-    return (minlon, minlat, maxlon, maxlat)
+    lons, lats = to_4326_arr([minx, maxx], [miny, maxy])
+    return (min(lons), min(lats), max(lons), max(lats))
 
 def point_to_tile(lat: float, lon: float, path: str = DEFAULT_TILE_INDEX) -> Optional[str]:
     """Return the slash-form tile_id containing a WGS84 (lat, lon) point, or None."""
@@ -110,8 +123,5 @@ def gpkg_bbox_4326_for_tile(tile_id: str) -> Optional[Tuple[float,float,float,fl
     if g.empty:
         return None
     minx, miny, maxx, maxy = g.total_bounds
-    bl = to_4326(minx, miny)
-    tr = to_4326(maxx, maxy)
-    minlon, minlat = min(bl[0], tr[0]), min(bl[1], tr[1])
-    maxlon, maxlat = max(bl[0], tr[0]), max(bl[1], tr[1])
-    return (minlon, minlat, maxlon, maxlat)
+    lons, lats = to_4326_arr([minx, maxx], [miny, maxy])
+    return (min(lons), min(lats), max(lons), max(lats))
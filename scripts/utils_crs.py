@@ -1,8 +1,17 @@
-from pyproj import Transformer
+from functools import lru_cache
+
+from pyproj import CRS, Transformer
+
+
+@lru_cache(maxsize=8)
+def get_transformer(src, dst) -> Transformer:
+    """Memoized always_xy Transformer; PROJ pipeline setup is paid once per (src, dst) per process."""
+    return Transformer.from_crs(src, dst, always_xy=True)
+
 
 # Thread-safe in recent pyproj
-_T_4326_TO_28992 = Transformer.from_crs("EPSG:4326", "EPSG:28992", always_xy=True)
-_T_28992_TO_4326 = Transformer.from_crs("EPSG:28992", "EPSG:4326", always_xy=True)
+_T_4326_TO_28992 = get_transformer("EPSG:4326", "EPSG:28992")
+_T_28992_TO_4326 = get_transformer("EPSG:28992", "EPSG:4326")
 
 def to_28992(lon: float, lat: float):
     """WGS84 (lon, lat) -> RD New (x, y) in meters."""
@@ -11,3 +20,26 @@ def to_28992(lon: float, lat: float):
 def to_4326(x: float, y: float):
     """RD New (x, y) -> WGS84 (lon, lat)."""
     return _T_28992_TO_4326.transform(x, y)
+
+def to_28992_arr(lons, lats):
+    """Vectorized to_28992: arrays/sequences of lon, lat -> (xs, ys) in one PROJ call."""
+    return _T_4326_TO_28992.transform(lons, lats)
+
+def to_4326_arr(xs, ys):
+    """Vectorized to_4326: arrays/sequences of x, y -> (lons, lats) in one PROJ call."""
+    return _T_28992_TO_4326.transform(xs, ys)
+
+def horizontal_crs(crs):
+    """Horizontal component of a compound CRS (e.g. RD+NAP EPSG:7415 -> EPSG:28992), else `crs` as a CRS."""
+    if crs is None:
+        return None
+    crs = CRS.from_user_input(crs)
+    return crs.sub_crs_list[0] if crs.is_compound else crs
+
+def is_rd_new(crs) -> bool:
+    """
+    True if `crs` is RD New horizontally: EPSG:28992, or a compound CRS over it such as the
+    RD+NAP EPSG:7415 used by 3D BAG. Such data can be relabeled instead of reprojected.
+    """
+    horiz = horizontal_crs(crs)
+    return horiz is not None and horiz.to_epsg() == 28992
@@ -0,0 +1,17 @@
+import json
+
+try:  # optional: C JSON codec (pip install orjson), ~5x faster; same documents either way
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(raw):
+    """Parse one JSON document from bytes/str."""
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """UTF-8 JSON bytes (non-ASCII kept as-is); indent=True pretty-prints with 2 spaces."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
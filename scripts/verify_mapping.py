@@ -1,80 +1,79 @@
 # scripts/verify_mapping.py
-import json
 import argparse
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import geopandas as gpd
+import shapely
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from shapely.geometry import Point, box
 from shapely.strtree import STRtree
-from shapely import make_valid
-from pyproj import Transformer
 
+from scripts.buildings_cache import load_buildings_and_tree, tile_bbox
 from scripts.tiles import tile_polygon
+from scripts.utils_crs import get_transformer
+from scripts.utils_json import loads
 
 DEFAULT_LAYER = "lod22_2d"
 FALLBACK_LAYER = "lod13_2d"
+DENSE_POINTS = 5000  # above this many cameras the overlay bins inside points with hexbin
 
-def _load_buildings(gpkg_path: Path, layer: str) -> gpd.GeoDataFrame:
-    try:
-        gdf = gpd.read_file(gpkg_path, layer=layer)
-    except Exception as e:
-        print(f"[w] Failed to read layer '{layer}' via pyogrio: {e}; retrying with Fiona…")
-        gdf = gpd.read_file(gpkg_path, layer=layer, engine="fiona")
-    # Reproject to EPSG:28992 (from EPSG:7415 compound or whatever)
-    gdf = gdf.to_crs("EPSG:28992")
-    # Clean invalid geometries (make_valid -> explode multiparts -> drop empties)
-    gdf["geometry"] = gdf.geometry.apply(lambda g: make_valid(g) if g is not None else None)
-    gdf = gdf.explode(index_parts=False, ignore_index=True)
-    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notnull()]
-    gdf = gdf[gdf.geometry.is_valid]
-    gdf.reset_index(drop=True, inplace=True)
-    return gdf
-
-def _load_points(meta_dir: Path) -> gpd.GeoDataFrame:
+def _load_points_xy(meta_dir: Path) -> pd.DataFrame:
+    """Camera rows with x_28992/y_28992; Point geometry is built lazily (see _points_geo)."""
     pq = meta_dir / "meta_28992.parquet"
+    geo_pq = meta_dir / "meta_28992_geo.parquet"  # augment_meta --write-geo
     jl = meta_dir / "meta_28992.jsonl"
+    # GeoParquet carries the point geometry already (GeoArrow-encoded): no points_from_xy pass.
+    # Only trusted when not older than the plain Parquet it was written alongside.
+    if geo_pq.exists() and (not pq.exists() or geo_pq.stat().st_mtime >= pq.stat().st_mtime):
+        gdf = gpd.read_parquet(geo_pq)
+        if {"x_28992","y_28992"}.issubset(gdf.columns):
+            return gdf.to_crs("EPSG:28992") if gdf.crs is not None and gdf.crs.to_epsg() != 28992 else gdf
     if pq.exists():
         df = pd.read_parquet(pq)
         if not {"x_28992","y_28992"}.issubset(df.columns):
             raise SystemExit(f"{pq} missing x_28992/y_28992")
-        return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["x_28992"], df["y_28992"]), crs="EPSG:28992")
+        return df
     if jl.exists():
-        rows = []
-        with open(jl, "r") as f:
-            for line in f:
-                line=line.strip()
-                if not line: continue
-                rows.append(json.loads(line))
-        df = pd.DataFrame(rows)
+        with open(jl, "rb") as f:
+            df = pd.DataFrame([loads(line) for line in f if line.strip()])
         if not {"x_28992","y_28992"}.issubset(df.columns):
             if not {"lon","lat"}.issubset(df.columns):
                 raise SystemExit("Need lon/lat or x_28992/y_28992 in meta.")
-            t = Transformer.from_crs("EPSG:4326","EPSG:28992",always_xy=True)
-            x,y = t.transform(df["lon"].astype(float).values, df["lat"].astype(float).values)
+            t = get_transformer("EPSG:4326", "EPSG:28992")
+            x,y = t.transform(np.ascontiguousarray(df["lon"].to_numpy(dtype=np.float64)),
+                              np.ascontiguousarray(df["lat"].to_numpy(dtype=np.float64)))
             df["x_28992"], df["y_28992"] = x,y
-        return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["x_28992"], df["y_28992"]), crs="EPSG:28992")
+        return df
     raise SystemExit("No meta_28992.{parquet|jsonl} found. Run scripts/augment_meta.py first.")
 
-def _distance_to_buildings(points_gdf: gpd.GeoDataFrame, buildings_gdf: gpd.GeoDataFrame) -> np.ndarray:
+def _points_geo(df: pd.DataFrame) -> np.ndarray:
+    """Point geometries for spatial queries: reused from GeoParquet, else one shapely.points call."""
+    if isinstance(df, gpd.GeoDataFrame):
+        return df.geometry.to_numpy()
+    return shapely.points(df["x_28992"].to_numpy(dtype=float), df["y_28992"].to_numpy(dtype=float))
+
+def _nearest_distances(pts: np.ndarray, tree: STRtree) -> np.ndarray:
     """
-    Robust nearest distance using STRtree (no dissolve). Returns array of distances (meters).
+    Distance from each point to its nearest tree geometry via one bulk query (GEOS computes
+    the distances in C). Missing/empty points, or an empty tree, yield NaN.
     """
-    geoms = list(buildings_gdf.geometry.values)
-    tree = STRtree(geoms)
-    # For each point, query nearest building geometry and compute precise distance
-    dists = []
-    for pt in points_gdf.geometry.values:
-        idx = tree.nearest(pt)
-        if idx is None:
-            dists.append(np.nan)
-        else:
-            dists.append(pt.distance(geoms[idx]))
-    return np.array(dists, dtype=float)
+    dists = np.full(len(pts), np.nan)
+    if len(tree) and len(pts):
+        (pt_idx, _), d = tree.query_nearest(pts, return_distance=True, all_matches=False)
+        dists[pt_idx] = d
+    return dists
 
 def _load_roads_osm(tile_poly_28992, cache_path: Path | None):
+    if cache_path and cache_path.exists():
+        try:
+            return gpd.read_parquet(cache_path)  # EPSG:28992 edges from an earlier run
+        except Exception as e:
+            print(f"[w] Ignoring road cache {cache_path}: {e}")
     try:
         import osmnx as ox
     except Exception:
@@ -90,10 +89,24 @@ def _load_roads_osm(tile_poly_28992, cache_path: Path | None):
     edges = edges.to_crs("EPSG:28992")
     if cache_path:
         cache_path.parent.mkdir(parents=True, exist_ok=True)
-        edges.to_parquet(cache_path, index=False)
+        edges.to_parquet(cache_path, index=False, write_covering_bbox=True)
     return edges
 
-def main():
+def _write_csv(df: pd.DataFrame, path: Path):
+    try:
+        # Arrow's multithreaded C++ writer; no per-row Python formatting
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
+    except (pa.ArrowException, TypeError, ValueError):  # e.g. mixed-type object columns
+        df.to_csv(path, index=False)
+
+def _outline_collection(gdf: gpd.GeoDataFrame, **kwargs) -> LineCollection:
+    """All polygon rings (exteriors + holes) as one LineCollection: one artist instead of a patch per feature."""
+    rings = shapely.get_rings(shapely.get_parts(gdf.geometry.to_numpy()))  # footprints may be multi-part
+    coords, idx = shapely.get_coordinates(rings, return_index=True)
+    splits = np.flatnonzero(np.diff(idx)) + 1
+    return LineCollection(np.split(coords, splits) if len(coords) else [], **kwargs)
+
+def main(argv=None):
     ap = argparse.ArgumentParser()
     ap.add_argument("--tile-id", required=True, help="e.g., 10-430-720")
     ap.add_argument("--mesh-root", default="data/amsterdam/mesh")
@@ -101,7 +114,8 @@ def main():
     ap.add_argument("--layer", default=DEFAULT_LAYER)
     ap.add_argument("--out-prefix", default="outputs/verify")
     ap.add_argument("--with-roads", action="store_true", help="Fetch OSM roads and compute distance-to-road")
-    args = ap.parse_args()
+    ap.add_argument("--csv", action="store_true", help="Also write diagnostics.csv (diagnostics.parquet is always written)")
+    args = ap.parse_args(argv)
 
     tile = args.tile_id
     gpkg = Path(args.mesh_root) / tile / f"{tile}.gpkg"
@@ -113,20 +127,24 @@ def main():
         raise SystemExit(f"Missing GPKG: {gpkg}")
 
     # --- Load data ---
-    try:
-        buildings = _load_buildings(gpkg, layer=args.layer)
-    except SystemExit:
-        print(f"[w] Falling back to {FALLBACK_LAYER}")
-        buildings = _load_buildings(gpkg, layer=FALLBACK_LAYER)
-
     tile_poly = tile_polygon(tile)  # EPSG:28992
     if tile_poly is None:
         raise SystemExit(f"Tile polygon not found for {tile}")
+    bbox = tile_bbox(tile_poly)
 
-    cams = _load_points(meta_dir)
+    try:
+        buildings, bldg_tree = load_buildings_and_tree(gpkg, layer=args.layer, bbox=bbox)
+    except SystemExit:
+        print(f"[w] Falling back to {FALLBACK_LAYER}")
+        buildings, bldg_tree = load_buildings_and_tree(gpkg, layer=FALLBACK_LAYER, bbox=bbox)
+
+    cams = _load_points_xy(meta_dir)
 
     # --- Inside tile polygon ---
-    inside_mask = cams.within(tile_poly)
+    # One vectorized GEOS call on the raw coordinates (prepared polygon), no per-Point dispatch
+    shapely.prepare(tile_poly)
+    inside_mask = shapely.contains_xy(tile_poly, cams["x_28992"].to_numpy(dtype=float),
+                                      cams["y_28992"].to_numpy(dtype=float))
     cams["inside_tile"] = inside_mask
     n_total = len(cams)
     n_inside = int(inside_mask.sum())
@@ -134,66 +152,81 @@ def main():
     print(f"[i] Points: {n_total} | inside tile polygon: {n_inside} | outside: {n_outside}")
 
     # --- Distance to buildings (robust via STRtree) ---
-    dists = _distance_to_buildings(cams, buildings)
+    pts = _points_geo(cams)
+    dists = _nearest_distances(pts, bldg_tree)
     cams["dist_to_bldg_m"] = dists
-    p50 = float(np.nanpercentile(dists, 50))
-    p90 = float(np.nanpercentile(dists, 90))
-    pmax = float(np.nanmax(dists))
-    print(f"[i] dist→buildings (m): p50={p50:.1f} | p90={p90:.1f} | max={pmax:.1f}")
+    # Buildings are only read around the tile, so outside points may lack their true nearest
+    # building: percentiles, histogram and heuristic use inside-tile distances only
+    inside_dists = dists[inside_mask]
+    p50 = p90 = pmax = float("nan")
+    if np.isfinite(inside_dists).any():
+        p50, p90, pmax = (float(v) for v in np.nanpercentile(inside_dists, [50, 90, 100]))
+        print(f"[i] dist→buildings, inside tile (m): p50={p50:.1f} | p90={p90:.1f} | max={pmax:.1f}")
+    else:
+        print("[w] No inside-tile points with a building distance.")
 
     # --- Optional: distance to roads ---
     if args.with_roads:
         cache = out_prefix / "osm_roads.parquet"
         roads = _load_roads_osm(tile_poly, cache)
         if roads is not None and not roads.empty:
-            rtree = STRtree(list(roads.geometry.values))
-            rdists = []
-            for pt in cams.geometry.values:
-                idx = rtree.nearest(pt)
-                rdists.append(pt.distance(roads.geometry.values[idx]) if idx is not None else np.nan)
-            cams["dist_to_road_m"] = np.array(rdists, dtype=float)
-            rp50 = float(np.nanpercentile(cams["dist_to_road_m"], 50))
-            rp90 = float(np.nanpercentile(cams["dist_to_road_m"], 90))
-            rpmax = float(np.nanmax(cams["dist_to_road_m"]))
+            cams["dist_to_road_m"] = _nearest_distances(pts, STRtree(roads.geometry.to_numpy()))
+            rp50, rp90, rpmax = (float(v) for v in np.nanpercentile(cams["dist_to_road_m"], [50, 90, 100]))
             print(f"[i] dist→roads (m): p50={rp50:.1f} | p90={rp90:.1f} | max={rpmax:.1f}")
         else:
             print("[w] No OSM roads fetched; skipping road distances.")
 
-    # --- Save diagnostics CSV ---
+    # --- Save diagnostics (Parquet; CSV copy on request) ---
     diag_cols = ["id","lon","lat","x_28992","y_28992","inside_tile","dist_to_bldg_m"]
     if "dist_to_road_m" in cams.columns:
         diag_cols.append("dist_to_road_m")
     for c in ["camera_type","captured_at","captured_at_utc","sequence_id","thumb_1024_url"]:
         if c in cams.columns:
             diag_cols.append(c)
-    pd.DataFrame(cams[diag_cols]).to_csv(out_prefix / "diagnostics.csv", index=False)
-    print(f"[i] Wrote {out_prefix / 'diagnostics.csv'}")
+    diag = pd.DataFrame(cams[diag_cols])
+    diag.to_parquet(out_prefix / "diagnostics.parquet", index=False, compression="zstd")
+    print(f"[i] Wrote {out_prefix / 'diagnostics.parquet'}")
+    if args.csv:
+        _write_csv(diag, out_prefix / "diagnostics.csv")
+        print(f"[i] Wrote {out_prefix / 'diagnostics.csv'}")
 
     # --- Plots ---
     plt.figure(figsize=(7,4))
-    plt.hist(cams["dist_to_bldg_m"].dropna(), bins=40)
-    plt.title(f"Distance to buildings — {tile}")
+    plt.hist(inside_dists[np.isfinite(inside_dists)], bins=40)
+    plt.title(f"Distance to buildings (inside tile) — {tile}")
     plt.xlabel("meters"); plt.ylabel("count")
     plt.tight_layout()
     plt.savefig(out_prefix / "hist_dist_buildings.png", dpi=200)
+    plt.close()
     print(f"[i] Wrote {out_prefix / 'hist_dist_buildings.png'}")
 
     tile_gdf = gpd.GeoDataFrame(geometry=[tile_poly], crs="EPSG:28992")
     fig, ax = plt.subplots(figsize=(8,8))
     tile_gdf.boundary.plot(ax=ax, color="tab:blue", linewidth=1.3)
-    buildings.plot(ax=ax, edgecolor="black", facecolor="none", linewidth=0.4)
-    cams[cams["inside_tile"]].plot(ax=ax, markersize=6, alpha=0.9)
-    if n_outside:
-        cams[~cams["inside_tile"]].plot(ax=ax, markersize=6, alpha=0.3)
+    ax.add_collection(_outline_collection(buildings, colors="black", linewidths=0.4))
+    ax.autoscale_view()
+    xs, ys = cams["x_28992"].to_numpy(), cams["y_28992"].to_numpy()
+    inside = cams["inside_tile"].to_numpy()
+    if n_total > DENSE_POINTS:
+        # Dense tile: binned density (constant render cost) instead of one marker per camera
+        if n_inside:
+            ax.hexbin(xs[inside], ys[inside], gridsize=150, mincnt=1)
+        if n_outside:
+            ax.scatter(xs[~inside], ys[~inside], s=6, alpha=0.3, rasterized=True)
+    else:
+        ax.scatter(xs[inside], ys[inside], s=6, alpha=0.9)
+        if n_outside:
+            ax.scatter(xs[~inside], ys[~inside], s=6, alpha=0.3)
     ax.set_aspect("equal")
     ax.set_title(f"QA overlay — {tile}")
     plt.tight_layout()
     plt.savefig(out_prefix / "overlay.png", dpi=200)
+    plt.close(fig)
     print(f"[i] Wrote {out_prefix / 'overlay.png'}")
 
     # --- Simple pass/fail heuristic ---
     ok_inside = n_inside / max(1, n_total) >= 0.75    # relaxed to 75% since you used margin
-    ok_dist   = p90 <= 30.0                           # tune by area density
+    ok_dist   = p90 <= 30.0                           # tune by area density; NaN fails
     print(f"[i] Heuristic: inside≥75%? {ok_inside} | p90≤30m? {ok_dist}")
     if ok_inside and ok_dist:
         print("[✓] Mapping verification looks good.")
@@ -0,0 +1,26 @@
+import json
+
+import numpy as np
+
+from scripts.plot_tile_overlay import load_meta_points_jsonl
+
+
+def test_load_meta_points_jsonl(tmp_path):
+    meta = tmp_path / "meta.jsonl"
+    rows = [
+        {"id": "1", "lon": 4.90, "lat": 52.37},
+        {"id": "2", "lon": None, "lat": 52.38},
+        {"id": "3", "lon": 4.91, "lat": 52.39},
+    ]
+    # blank line in the middle and no trailing newline
+    meta.write_text(json.dumps(rows[0]) + "\n\n" + "\n".join(json.dumps(r) for r in rows[1:]))
+    lons, lats = load_meta_points_jsonl(meta)
+    np.testing.assert_allclose(lons, [4.90, 4.91])
+    np.testing.assert_allclose(lats, [52.37, 52.39])
+
+
+def test_load_meta_points_jsonl_empty(tmp_path):
+    meta = tmp_path / "meta.jsonl"
+    meta.write_bytes(b"")
+    lons, lats = load_meta_points_jsonl(meta)
+    assert lons.size == 0 and lats.size == 0
@@ -1,15 +1,45 @@
 # tools/run_for_tiles.py
 import argparse
 import csv
+import importlib
 import subprocess
 import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from time import sleep
 
+# Run `python -m scripts.x ...` steps by calling scripts.x.main(argv) in this interpreter,
+# so each step doesn't pay a fresh interpreter start + geopandas/shapely/pyproj import
+IN_PROCESS = True
+
+def _call_main(mod, argv):
+    try:
+        mod.main(argv)
+    except SystemExit as e:
+        if e.code is None or e.code == 0:
+            return 0
+        if not isinstance(e.code, int):
+            print(e.code, file=sys.stderr)  # as the interpreter does for a subprocess
+            return 1
+        return e.code
+    except Exception as e:
+        print(f"[!] {mod.__name__} raised {type(e).__name__}: {e}")
+        traceback.print_exc()  # stderr, as the subprocess would have shown it
+        return 1
+    return 0
+
 def sh(cmd, dry=False):
     print("[cmd]", " ".join(cmd))
     if dry:
         return 0
+    if IN_PROCESS and cmd[:2] == [sys.executable, "-m"]:
+        try:
+            mod = importlib.import_module(cmd[2])
+        except ImportError:
+            mod = None  # e.g. not launched from the repo root: the subprocess path still works
+        if mod is not None:
+            return _call_main(mod, cmd[3:])
     return subprocess.call(cmd)
 
 def col_or_fail(row, names):
@@ -25,11 +55,191 @@ def dash_id(row):
 def need(path: Path):
     return not path.exists()
 
+def process_tile(t, args, steps):
+    """Run the selected steps for one tile; returns early (skipping later steps) on failure."""
+    print("\n" + "="*60)
+    print(f"[tile] {t}")
+    print("="*60)
+
+    mesh_dir = Path(args.mesh_root) / t
+    map_dir  = Path(args.mapillary_root) / t
+    aerial_dir = Path(args.aerial_root) / t
+    out_dir = Path(args.out_root) / t
+
+    # 1) Mesh
+    if "mesh" in steps:
+        if args.overwrite or need(mesh_dir / f"{t}.gpkg"):
+            rc = sh([sys.executable, "-m", "scripts.download_3dbag_tile", "--tile-id", t], args.dry_run)
+            if rc != 0:
+                print(f"[!] Mesh step failed for {t} (rc={rc}). Skipping this tile.")
+                return
+            sleep(args.sleep)
+        else:
+            print("[skip] mesh (already present)")
+
+    # 1b) Viewer footprints (pre-simplified GeoJSON)
+    if "geojson" in steps:
+        if args.overwrite or need(mesh_dir / "buildings_4326.geojson"):
+            cmd = [sys.executable, "-m", "scripts.build_buildings_geojson", "--tile-id", t,
+                   "--mesh-root", args.mesh_root]
+            if args.overwrite:
+                cmd.append("--overwrite")
+            rc = sh(cmd, args.dry_run)
+            if rc != 0:
+                print(f"[!] GeoJSON step failed for {t} (rc={rc}). Continuing without it.")
+        else:
+            print("[skip] geojson (buildings_4326.geojson exists)")
+
+    # 2) Mapillary
+    if "mapillary" in steps:
+        meta_jsonl = map_dir / "meta.jsonl"
+        if args.overwrite or need(meta_jsonl):
+            cmd = [
+                sys.executable, "-m", "scripts.fetch_mapillary",
+                "--tile-id", t,
+                "--max-images", str(args.max_images),
+                "--margin-m", str(args.margin_m),
+                "--subdivide", str(args.subdivide),
+                "--sleep", str(args.sleep),
+                "--api-limit", str(args.api_limit),
+                "--page-retries", str(args.page_retries),
+            ]
+            if args.iphone_only:
+                cmd.append("--iphone-only")
+            if args.no_thumbs:
+                cmd.append("--no-thumbs")
+            cmd += ["--thumb-size", str(args.thumb_size)]
+            if args.download_full:
+                cmd += ["--download-full", "--full-size", str(args.full_size)]
+            rc = sh(cmd, args.dry_run)
+            if rc != 0:
+                print(f"[!] Mapillary fetch failed for {t} (rc={rc}). Skipping remaining steps for this tile.")
+                return
+            sleep(args.sleep)
+        else:
+            print("[skip] mapillary (meta.jsonl exists)")
+
+    # 3) Augment
+    if "augment" in steps:
+        meta_pq = map_dir / "meta_28992.parquet"
+        if args.overwrite or need(meta_pq):
+            cmd = [sys.executable, "-m", "scripts.augment_meta", "--tile-id", t]
+            if args.overwrite:
+                cmd.append("--overwrite")
+            rc = sh(cmd, args.dry_run)
+            if rc != 0:
+                print(f"[!] Augment step failed for {t} (rc={rc}). Skipping this tile.")
+                return
+            sleep(args.sleep)
+        else:
+            print("[skip] augment (meta_28992.parquet exists)")
+
+    # 4) Verify
+    if "verify" in steps:
+        diag_dir = Path("outputs/verify") / t
+        if args.overwrite or (need(diag_dir / "diagnostics.parquet") and need(diag_dir / "diagnostics.csv")):
+            rc = sh([sys.executable, "-m", "scripts.verify_mapping", "--tile-id", t], args.dry_run)
+            if rc != 0:
+                print(f"[!] Verify step failed for {t} (rc={rc}). Skipping this tile.")
+                return
+            sleep(args.sleep)
+        else:
+            print("[skip] verify (diagnostics exist)")
+
+    # 5) Clean subset (thumbs + optional full-res)
+    if "clean" in steps:
+        clean_pq = map_dir / "meta_clean.parquet"
+        if args.overwrite or need(clean_pq):
+            # 5a) Thumbs clean set -> images_clean from images
+            cmd = [
+                sys.executable, "-m", "scripts.make_clean_subset",
+                "--tile-id", t,
+                "--mesh-root", args.mesh_root,
+                "--map-root", args.mapillary_root,
+                "--layer", args.clean_layer,
+                "--dist-thresh-m", str(args.clean_dist),
+                "--symlink-images",
+                "--source-dir", "images",
+                "--dest-name", "images_clean",
+            ]
+            if args.clean_copy:
+                cmd.append("--copy")
+            rc = sh(cmd, args.dry_run)
+            if rc != 0:
+                print(f"[!] Clean subset (thumbs) failed for {t} (rc={rc}). Skipping this tile.")
+                return
+            sleep(args.sleep)
+
+            # 5b) Optional full-res clean set -> images_full_clean from images_full
+            if args.clean_full:
+                cmd2 = [
+                    sys.executable, "-m", "scripts.make_clean_subset",
+                    "--tile-id", t,
+                    "--mesh-root", args.mesh_root,
+                    "--map-root", args.mapillary_root,
+                    "--layer", args.clean_layer,
+                    "--dist-thresh-m", str(args.clean_dist),
+                    "--symlink-images",
+                    "--source-dir", "images_full",
+                    "--dest-name", "images_full_clean",
+                ]
+                if args.clean_copy:
+                    cmd2.append("--copy")
+                rc2 = sh(cmd2, args.dry_run)
+                if rc2 != 0:
+                    print(f"[!] Clean subset (full-res) failed for {t} (rc={rc2}). Skipping this tile.")
+                    return
+                sleep(args.sleep)
+        else:
+            print("[skip] clean (meta_clean.parquet exists)")
+
+    # 6) Aerial
+    if "aerial" in steps:
+        aerial_tif = None
+        for p in aerial_dir.glob("aerial_*m.tif"):
+            if "raw" not in p.name:
+                aerial_tif = p
+                break
+        if args.overwrite or aerial_tif is None:
+            rc = sh([
+                sys.executable, "-m", "scripts.fetch_aerial_nl",
+                "--tile-id", t, "--layer", args.aerial_layer, "--gsd", str(args.aerial_gsd)
+            ], args.dry_run)
+            if rc != 0:
+                print(f"[!] Aerial step failed for {t} (rc={rc}). Skipping this tile.")
+                return
+            sleep(args.sleep)
+        else:
+            print("[skip] aerial (clipped tif exists)")
+
+    # 7) Manifest
+    if "manifest" in steps:
+        manifest = out_dir / "manifest.json"
+        if args.overwrite or need(manifest):
+            cmd = [
+                sys.executable, "-m", "scripts.build_manifest",
+                "--tile-id", t,
+                "--mesh-root", args.mesh_root,
+                "--mapillary-root", args.mapillary_root,
+                "--aerial-root", args.aerial_root,
+                "--out-root", args.out_root
+            ]
+            if args.overwrite:
+                cmd.append("--force")
+            rc = sh(cmd, args.dry_run)
+            if rc != 0:
+                print(f"[!] Manifest step failed for {t} (rc={rc}).")
+                return
+            sleep(args.sleep)
+        else:
+            print("[skip] manifest (exists)")
+
 def main():
     ap = argparse.ArgumentParser(description="Run the crossview pipeline for many tiles.")
     ap.add_argument("--csv", required=True, help="CSV with tile ids (tile_id_dash or tile_id_slash column)")
     ap.add_argument("--steps", default="mesh,mapillary,augment,verify,clean,aerial,manifest",
-                    help="Comma list: mesh,mapillary,augment,verify,clean,aerial,manifest")
+                    help="Comma list: mesh,geojson,mapillary,augment,verify,clean,aerial,manifest "
+                         "(geojson = viewer footprints, opt-in)")
     ap.add_argument("--data-root", default="data/amsterdam", help="Base data dir")
 
     # roots (can be overridden)
@@ -66,11 +276,19 @@ def main():
 
     # Misc
     ap.add_argument("--sleep", type=float, default=0.5, help="Seconds between steps (also passed to fetch_mapillary)")
+    ap.add_argument("--parallel-tiles", type=int, default=1,
+                    help="Process N tiles concurrently (steps within a tile stay sequential)")
+    ap.add_argument("--isolate", action="store_true",
+                    help="Run each step in its own Python subprocess (default: in-process; forced with --parallel-tiles > 1)")
     ap.add_argument("--dry-run", action="store_true")
     ap.add_argument("--overwrite", action="store_true", help="Force rerun even if outputs exist")
     args = ap.parse_args()
 
     steps = [s.strip() for s in args.steps.split(",") if s.strip()]
+    # The steps' module-level caches and pyplot state are not thread-safe: concurrent tiles
+    # get their own interpreters
+    global IN_PROCESS
+    IN_PROCESS = not args.isolate and args.parallel_tiles <= 1
     csv_path = Path(args.csv)
 
     with open(csv_path, newline="") as f:
@@ -83,167 +301,13 @@ def main():
 
     print(f"[i] Running for {len(tiles)} tiles: {tiles}")
 
-    for t in tiles:
-        print("\n" + "="*60)
-        print(f"[tile] {t}")
-        print("="*60)
-
-        mesh_dir = Path(args.mesh_root) / t
-        map_dir  = Path(args.mapillary_root) / t
-        aerial_dir = Path(args.aerial_root) / t
-        out_dir = Path(args.out_root) / t
-
-        # 1) Mesh
-        if "mesh" in steps:
-            if args.overwrite or need(mesh_dir / f"{t}.gpkg"):
-                rc = sh([sys.executable, "-m", "scripts.download_3dbag_tile", "--tile-id", t], args.dry_run)
-                if rc != 0:
-                    print(f"[!] Mesh step failed for {t} (rc={rc}). Skipping this tile.")
-                    continue
-                sleep(args.sleep)
-            else:
-                print("[skip] mesh (already present)")
-
-        # 2) Mapillary
-        if "mapillary" in steps:
-            meta_jsonl = map_dir / "meta.jsonl"
-            if args.overwrite or need(meta_jsonl):
-                cmd = [
-                    sys.executable, "-m", "scripts.fetch_mapillary",
-                    "--tile-id", t,
-                    "--max-images", str(args.max_images),
-                    "--margin-m", str(args.margin_m),
-                    "--subdivide", str(args.subdivide),
-                    "--sleep", str(args.sleep),
-                    "--api-limit", str(args.api_limit),
-                    "--page-retries", str(args.page_retries),
-                ]
-                if args.iphone_only:
-                    cmd.append("--iphone-only")
-                if args.no_thumbs:
-                    cmd.append("--no-thumbs")
-                cmd += ["--thumb-size", str(args.thumb_size)]
-                if args.download_full:
-                    cmd += ["--download-full", "--full-size", str(args.full_size)]
-                rc = sh(cmd, args.dry_run)
-                if rc != 0:
-                    print(f"[!] Mapillary fetch failed for {t} (rc={rc}). Skipping remaining steps for this tile.")
-                    continue
-                sleep(args.sleep)
-            else:
-                print("[skip] mapillary (meta.jsonl exists)")
-
-        # 3) Augment
-        if "augment" in steps:
-            meta_pq = map_dir / "meta_28992.parquet"
-            if args.overwrite or need(meta_pq):
-                cmd = [sys.executable, "-m", "scripts.augment_meta", "--tile-id", t]
-                if args.overwrite:
-                    cmd.append("--overwrite")
-                rc = sh(cmd, args.dry_run)
-                if rc != 0:
-                    print(f"[!] Augment step failed for {t} (rc={rc}). Skipping this tile.")
-                    continue
-                sleep(args.sleep)
-            else:
-                print("[skip] augment (meta_28992.parquet exists)")
-
-        # 4) Verify
-        if "verify" in steps:
-            diag_csv = Path("outputs/verify") / t / "diagnostics.csv"
-            if args.overwrite or need(diag_csv):
-                rc = sh([sys.executable, "-m", "scripts.verify_mapping", "--tile-id", t], args.dry_run)
-                if rc != 0:
-                    print(f"[!] Verify step failed for {t} (rc={rc}). Skipping this tile.")
-                    continue
-                sleep(args.sleep)
-            else:
-                print("[skip] verify (diagnostics exist)")
-
-        # 5) Clean subset (thumbs + optional full-res)
-        if "clean" in steps:
-            clean_pq = map_dir / "meta_clean.parquet"
-            if args.overwrite or need(clean_pq):
-                # 5a) Thumbs clean set -> images_clean from images
-                cmd = [
-                    sys.executable, "-m", "scripts.make_clean_subset",
-                    "--tile-id", t,
-                    "--mesh-root", args.mesh_root,
-                    "--map-root", args.mapillary_root,
-                    "--layer", args.clean_layer,
-                    "--dist-thresh-m", str(args.clean_dist),
-                    "--symlink-images",
-                    "--source-dir", "images",
-                    "--dest-name", "images_clean",
-                ]
-                if args.clean_copy:
-                    cmd.append("--copy")
-                rc = sh(cmd, args.dry_run)
-                if rc != 0:
-                    print(f"[!] Clean subset (thumbs) failed for {t} (rc={rc}). Skipping this tile.")
-                    continue
-                sleep(args.sleep)
-
-                # 5b) Optional full-res clean set -> images_full_clean from images_full
-                if args.clean_full:
-                    cmd2 = [
-                        sys.executable, "-m", "scripts.make_clean_subset",
-                        "--tile-id", t,
-                        "--mesh-root", args.mesh_root,
-                        "--map-root", args.mapillary_root,
-                        "--layer", args.clean_layer,
-                        "--dist-thresh-m", str(args.clean_dist),
-                        "--symlink-images",
-                        "--source-dir", "images_full",
-                        "--dest-name", "images_full_clean",
-                    ]
-                    if args.clean_copy:
-                        cmd2.append("--copy")
-                    rc2 = sh(cmd2, args.dry_run)
-                    if rc2 != 0:
-                        print(f"[!] Clean subset (full-res) failed for {t} (rc={rc2}). Skipping this tile.")
-                        continue
-                    sleep(args.sleep)
-            else:
-                print("[skip] clean (meta_clean.parquet exists)")
-
-        # 6) Aerial
-        if "aerial" in steps:
-            aerial_tif = None
-            for p in aerial_dir.glob("aerial_*m.tif"):
-                if "raw" not in p.name:
-                    aerial_tif = p
-                    break
-            if args.overwrite or aerial_tif is None:
-                rc = sh([
-                    sys.executable, "-m", "scripts.fetch_aerial_nl",
-                    "--tile-id", t, "--layer", args.aerial_layer, "--gsd", str(args.aerial_gsd)
-                ], args.dry_run)
-                if rc != 0:
-                    print(f"[!] Aerial step failed for {t} (rc={rc}). Skipping this tile.")
-                    continue
-                sleep(args.sleep)
-            else:
-                print("[skip] aerial (clipped tif exists)")
-
-        # 7) Manifest
-        if "manifest" in steps:
-            manifest = out_dir / "manifest.json"
-            if args.overwrite or need(manifest):
-                rc = sh([
-                    sys.executable, "-m", "scripts.build_manifest",
-                    "--tile-id", t,
-                    "--mesh-root", args.mesh_root,
-                    "--mapillary-root", args.mapillary_root,
-                    "--aerial-root", args.aerial_root,
-                    "--out-root", args.out_root
-                ], args.dry_run)
-                if rc != 0:
-                    print(f"[!] Manifest step failed for {t} (rc={rc}).")
-                    continue
-                sleep(args.sleep)
-            else:
-                print("[skip] manifest (exists)")
+    if args.parallel_tiles > 1:
+        # Steps are subprocesses (mostly network-bound), so threads are enough to overlap tiles
+        with ThreadPoolExecutor(max_workers=args.parallel_tiles) as ex:
+            list(ex.map(lambda t: process_tile(t, args, steps), tiles))
+    else:
+        for t in tiles:
+            process_tile(t, args, steps)
 
     print("\n[✓] Done.")
 